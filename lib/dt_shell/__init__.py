@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
+import time as _time
+
+# used by the startup profiler
+_import_started = _time.perf_counter()
+
 import logging
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 
 logging.basicConfig()
 
@@ -19,8 +24,8 @@ if sys.version_info < (3, 6):
     logging.error(msg)
     sys.exit(2)
 
-from .exceptions import ConfigInvalid, ConfigNotPresent
-from .utils import format_exception
+from .exceptions import *
+from .exceptions import __all__ as _exceptions_all
 
 # This was useful in the days of Python 2. Removing because it breaks when the shell is called
 # using pipes (e.g. unit tests).
@@ -32,17 +37,47 @@ from .utils import format_exception
 #     f"locale {locale.getpreferredencoding()}."
 # )
 
-from .cli import DTShell
-from .logging import dts_print
+# The public names below are imported the first time they are accessed, so that `import dt_shell`
+# does not pay for the shell, its dependencies (yaml, termcolor, cmd, ...) and the commands.
+_lazy_names = {
+    "DTShell": ".cli",
+    "dts_print": ".logging",
+    "DTCommandAbs": ".dt_command_abs",
+    "DTCommandPlaceholder": ".dt_command_placeholder",
+    "cli_main": ".main",
+    "OtherVersions": ".main",
+    "format_exception": ".utils",
+    "check_package_version": ".package_version_check",
+    "_get_installed_distributions": ".package_version_check",
+}
+
+__all__ = ["dtslogger", "shell"] + _exceptions_all + [n for n in _lazy_names if not n.startswith("_")]
+
+if TYPE_CHECKING:
+    from .cli import DTShell
 
-from .dt_command_abs import DTCommandAbs
-from .dt_command_placeholder import DTCommandPlaceholder
-from .main import cli_main
-from .exceptions import *
 
-from .main import OtherVersions
-from .package_version_check import *
+def __getattr__(name: str):
+    if name not in _lazy_names:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+
+    value = getattr(importlib.import_module(_lazy_names[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_names))
+
+
+if sys.version_info < (3, 7):
+    # module-level __getattr__ is not supported
+    for _name in _lazy_names:
+        __getattr__(_name)
 
 
 # singleton
-shell: Optional[DTShell] = None
+shell: Optional["DTShell"] = None
+
+_import_finished = _time.perf_counter()
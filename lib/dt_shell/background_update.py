@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+
+from . import dtslogger
+from .commands_trees import get_trees_dir
+from .config import RepoInfo
+
+__all__ = ["start_background_update"]
+
+
+def start_background_update(commands_path: str, repo_info: RepoInfo) -> None:
+    """Updates the commands in a detached process, which keeps going after this one exits.
+
+    The update is staged in a tree of its own, the shells running meanwhile are not affected.
+    """
+    log_file = os.path.join(get_trees_dir(commands_path), "update.log")
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+    args = [commands_path, repo_info.username, repo_info.project, repo_info.branch]
+    cmd = [sys.executable, "-m", __name__] + args
+    dtslogger.debug(f"Updating the commands in the background, see '{log_file}'.")
+    # an update that is still running might be writing to the log
+    with open(log_file, "a") as fp:
+        subprocess.Popen(
+            cmd, stdin=subprocess.DEVNULL, stdout=fp, stderr=subprocess.STDOUT, start_new_session=True
+        )
+
+
+def main() -> None:
+    from .update_utils import update_cached_commands
+
+    commands_path, username, project, branch = sys.argv[1:]
+    update_cached_commands(commands_path, RepoInfo(username, project, branch), wait=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import compileall
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Callable, List, Optional
+
+from . import dtslogger
+from .constants import DTShellConstants
+
+__all__ = ["get_pycache_prefix", "use_pycache_prefix", "precompile_commands"]
+
+
+def get_pycache_prefix(commands_path: str) -> Optional[str]:
+    """Returns where the bytecode of the commands should go, None for the usual __pycache__ dirs.
+
+    The prefix can be set with the env. variable DTSHELL_PYCACHE_PREFIX, read-only commands trees
+    default to a prefix inside the shell directory.
+    """
+    V = DTShellConstants.ENV_PYCACHE_PREFIX
+    if os.environ.get(V):
+        return os.path.abspath(os.path.expanduser(os.environ[V]))
+    if os.path.isdir(commands_path) and not os.access(commands_path, os.W_OK):
+        return os.path.join(os.path.expanduser(DTShellConstants.ROOT), "pycache")
+    return None
+
+
+def use_pycache_prefix(commands_path: str) -> None:
+    """Makes this process (and its children) read/write bytecode in the pycache prefix, if any."""
+    prefix = get_pycache_prefix(commands_path)
+    if prefix is None:
+        return
+    if sys.version_info < (3, 8):
+        dtslogger.debug("A pycache prefix requires Python 3.8 or newer, ignoring it.")
+        return
+    sys.pycache_prefix = prefix
+    # spawned processes do not inherit sys.pycache_prefix
+    os.environ["PYTHONPYCACHEPREFIX"] = prefix
+
+
+def precompile_commands(commands_path: str) -> None:
+    """Compiles all the Python files of the commands (including their libraries) in parallel.
+
+    This way the first run of a command after an install/update does not pay for the compilation.
+    """
+    use_pycache_prefix(commands_path)
+    started = time.time()
+    sources = _find_sources(commands_path)
+    compile_file = partial(compileall.compile_file, quiet=2)
+    try:
+        results = _compile_files(compile_file, sources)
+    except Exception as e:
+        # e.g., a worker was killed (out of memory), the commands are compiled when they are imported anyway
+        dtslogger.debug(f"Could not compile the commands in '{commands_path}': {e!r}")
+        return
+    failed = results.count(False)
+    elapsed = time.time() - started
+    dtslogger.debug(
+        f"Compiled {len(sources) - failed}/{len(sources)} files in '{commands_path}' in {elapsed:.2f}s."
+    )
+
+
+def _compile_files(compile_file: Callable[[str], bool], sources: List[str]) -> List[bool]:
+    try:
+        # forking while other threads run (e.g., the update checks) can deadlock the children
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        with ProcessPoolExecutor(mp_context=context) as executor:
+            return list(executor.map(compile_file, sources, chunksize=32))
+    except (OSError, NotImplementedError, ImportError) as e:
+        # e.g., no /dev/shm, or no working multiprocessing on this platform
+        dtslogger.debug(f"Cannot compile the commands in parallel ({e}), compiling them serially.")
+        return list(map(compile_file, sources))
+
+
+def _find_sources(commands_path: str) -> List[str]:
+    sources = []
+    for path, dirs, files in os.walk(commands_path):
+        dirs[:] = [d for d in dirs if d != "__pycache__" and not d.startswith(".")]
+        sources.extend(os.path.join(path, f) for f in files if f.endswith(".py"))
+    return sources
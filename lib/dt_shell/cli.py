@@ -1,16 +1,16 @@
 # -*- coding: utf-8 -*-
 import os
 import random
+import shlex
 import sys
-import time
-import types
 from cmd import Cmd
 from dataclasses import dataclass
-from os import remove, utime
+from os import remove
 from os.path import exists, isfile, join
-from typing import Mapping, Optional, Sequence, List
+from typing import Dict, IO, Iterable, List, Optional, Sequence, TYPE_CHECKING
 
 from . import dtslogger
+from .bytecode import use_pycache_prefix
 from .commands_ import (
     _get_commands,
     _init_commands,
@@ -18,6 +18,12 @@ from .commands_ import (
     _ensure_commands_updated,
     InvalidRemote,
 )
+from .background_update import start_background_update
+from .commands_index import CommandsIndex, get_commands_index, set_user_installed, USER_FLAG
+from .commands_registry import CommandNode, CommandsNamespace, CommandsRegistry
+from .commands_trees import is_double_buffered, lease_tree, migrate_commands_tree
+from .completion import CompletionCache
+from .completion_scripts import update_completion_scripts
 from .config import (
     get_config_path,
     RepoInfo,
@@ -25,12 +31,16 @@ from .config import (
     ShellConfig,
     write_shell_config,
 )
-from .constants import DEBUG, DTShellConstants, INTRO
-from .dt_command_abs import DTCommandAbs
-from .dt_command_placeholder import DTCommandPlaceholder
-from .exceptions import CommandsLoadingException, UserError
+from .constants import DTShellConstants, INTRO
+from .exceptions import CommandsLoadingException
+from .importer import install_commands_finder
 from .logging import dts_print
-from .version_check import check_if_outdated
+from .profiling import profile_phase
+from .startup_checks import StartupChecks
+from .update_utils import get_pending_commands_update
+
+if TYPE_CHECKING:
+    from .watcher import CommandsWatcher
 
 
 BILLBOARDS_VERSION: str = "v1"
@@ -69,7 +79,6 @@ class DTShell(Cmd):
     errors_loading = []
 
     # config = {}
-    commands = {}
     core_commands = [
         "commands",
         "install",
@@ -85,29 +94,43 @@ class DTShell(Cmd):
     repo_info: RepoInfo
     commands_path: str
 
-    include: types.SimpleNamespace
+    include: CommandsNamespace
+    registry: CommandsRegistry
+    completion_cache: CompletionCache
+    commands_index: Optional[CommandsIndex] = None
+    watcher: Optional["CommandsWatcher"] = None
+    startup_checks: StartupChecks
+    # keeps the tree of commands in use from being removed by the updates
+    commands_lease: Optional[IO] = None
+    # the tree the registered commands are imported from (None until they are registered)
+    loaded_tree: Optional[str] = None
 
     def __init__(self, shell_config: ShellConfig, commands_info: CommandsInfo):
         self.shell_config = shell_config
         self.local_commands_info = commands_info
+        # leases on the trees replaced by an update, released once their commands are unloaded
+        self.stale_leases: List[IO] = []
 
         self.intro = INTRO()
-        setattr(DTShell, "include", types.SimpleNamespace())
+        self.registry = CommandsRegistry()
+        setattr(DTShell, "include", self.registry.include)
+        DTShell.errors_loading = self.registry.errors
+        self.completion_cache = CompletionCache()
 
         # dtslogger.debug('sys.argv: %s' % sys.argv)
-        check_if_outdated()
-
         self.repo_info = RepoInfo_for_version(shell_config.duckietown_version)
         self.commands_path = commands_path = self.local_commands_info.commands_path
 
-        # add commands_path to the path of this session
-        sys.path.insert(0, self.commands_path)
-        # add third-party libraries dir to the path of this session
-        sys.path.insert(0, os.path.join(self.commands_path, "lib"))
+        # read/write the bytecode of the commands in a separate prefix (if configured)
+        use_pycache_prefix(self.commands_path)
 
         # init commands
         cmds_just_initialized = False
 
+        # commands cloned in place by older versions of the shell are moved to a tree of their own
+        if not self.local_commands_info.leave_alone:
+            migrate_commands_tree(commands_path)
+
         # check if the commands path exists
         if exists(commands_path) and isfile(commands_path):
             remove(commands_path)
@@ -117,7 +140,8 @@ class DTShell(Cmd):
                 raise Exception(msg)
             dtslogger.warning(msg)
             try:
-                _init_commands(commands_path, self.repo_info)
+                with profile_phase("init_commands"):
+                    _init_commands(commands_path, self.repo_info)
             except InvalidRemote as e:
                 msg = "I could not initialize the commands."
                 raise CommandsLoadingException(msg) from e
@@ -130,79 +154,161 @@ class DTShell(Cmd):
             import readline
 
             readline.set_completer_delims(readline.get_completer_delims().replace("-", "", 1))
-        # check for updates (if needed)
+        # install the updates of the commands found by a previous run, look for new ones (and for a new
+        # version of the shell) in the background; only `dts update` checks for updates and waits for them
         # Do not check it if we are using custom commands_path_leave_alone
-        if (
+        check_commands = (
             not cmds_just_initialized
             and not self.local_commands_info.leave_alone
             and "update" not in sys.argv
-        ):
-            self.update_commands()
+        )
+        if check_commands and get_pending_commands_update(commands_path) is not None:
+            if is_double_buffered(commands_path):
+                # the update is prepared next to the commands in use, there is nothing to wait for
+                start_background_update(commands_path, self.repo_info)
+                check_commands = False
+            else:
+                with profile_phase("update_commands"):
+                    self.update_commands()
+        self.startup_checks = StartupChecks(commands_path, self.repo_info, check_commands)
+        self.startup_checks.start()
+        self._lease_commands(commands_path)
 
         # show billboard (if any)
-        billboard: Optional[str] = self.get_billboard()
+        with profile_phase("get_billboard"):
+            billboard: Optional[str] = self.get_billboard()
         if billboard:
             print(billboard)
 
-        self.reload_commands()
+        with profile_phase("reload_commands"):
+            self.reload_commands()
 
     def save_config(self):
         write_shell_config(self.shell_config)
 
+    def preloop(self):
+        # reload the commands as they change on disk (useful while developing them)
+        if os.environ.get(DTShellConstants.ENV_WATCH, "0") not in ["", "0"]:
+            from .watcher import CommandsWatcher
+
+            dtslogger.info(f"Watching {self.commands_path} for changes.")
+            self.watcher = CommandsWatcher(self.commands_path)
+            self.watcher.start()
+
+    def postloop(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
+    def precmd(self, line):
+        # make sure the command that is about to run is up-to-date
+        self._reload_changed_commands()
+        return line
+
     def postcmd(self, stop, line):
         if len(line.strip()) > 0:
             print("")
+        self._reload_changed_commands()
+
+    def _reload_changed_commands(self):
+        if self.watcher is None:
+            return
+        changed = self.watcher.pop_changes()
+        if changed:
+            dtslogger.debug(f"Reloading changed commands: {sorted(changed)}")
+            self.reload_commands(packages=changed)
+
+    def onecmd_argv(self, argv: List[str]):
+        """Runs a command given as a list of arguments (e.g., the ones of `dts`) without parsing them again."""
+        if not argv:
+            return self.emptyline()
+        node = self.registry.commands.get(argv[0])
+        if node is None:
+            # commands implemented by the shell itself (e.g., `help`)
+            return self.onecmd(" ".join(shlex.quote(a) for a in argv))
+        return node.run(self, argv[1:])
 
     def emptyline(self):
         pass
 
+    def completenames(self, text, *ignored):
+        # first-level commands come from the registry, the others (e.g., `help`) from the class
+        builtins = [n for n in _BUILTIN_COMMANDS if n.startswith(text) and n not in self.registry.commands]
+        return self.registry.root.completions.find(text) + builtins
+
     def complete(self, text, state):
         res = super(DTShell, self).complete(text, state)
         if res is not None:
             res += " "
         return res
 
-    def reload_commands(self):
-        # get installed commands
-        installed_commands = self.commands.keys()
-        for command in installed_commands:
-            for a in ["do_", "complete_", "help_"]:
-                if hasattr(DTShell, a + command):
-                    delattr(DTShell, a + command)
-        # re-install commands
-        self.commands = _get_commands(self.commands_path)
-        if self.commands is None:
+    def reload_commands(self, packages: Optional[Iterable[str]] = None):
+        """Registers the installed commands, only reloading the ones that changed.
+
+        Commands that were removed are unregistered, commands whose files changed since they were
+        imported are unloaded (and imported again the next time they are used), the others are left alone.
+        If `packages` is given, only those first-level commands are checked for changes.
+        """
+        self.registry.errors.clear()
+        with profile_phase("get_commands"):
+            index = get_commands_index(self.commands_path)
+            commands = index.get_commands()
+        self.commands_index = index
+        # make the commands (and their third-party libraries) importable
+        install_commands_finder(index.modules)
+        if commands is None:
             dtslogger.error("No commands found.")
-            self.commands = {}
-        # load commands
-        # print('commands: %s' % self.commands)
-        for cmd, subcmds in self.commands.items():
-            # noinspection PyTypeChecker
-            self._load_commands("", cmd, subcmds, 0)
+            commands = {}
+        # an update activated another tree, everything imported from the previous one is stale
+        if self.loaded_tree is not None and self.loaded_tree != self.commands_path:
+            dtslogger.debug(f"The commands moved to '{self.commands_path}', reloading all of them.")
+            for command in list(self.registry.commands):
+                self._unload_command(command)
+            _forget_modules(self.loaded_tree)
+        self.loaded_tree = self.commands_path
+        for lease in self.stale_leases:
+            lease.close()
+        self.stale_leases.clear()
+        # unload commands that disappeared or changed
+        for command, node in list(self.registry.commands.items()):
+            if command not in commands or commands[command] != node.as_tree():
+                self._unload_command(command)
+            elif (packages is None or command in packages) and self._command_modified(node):
+                dtslogger.debug(f"Command `{command}` changed, reloading it.")
+                self._unload_command(command)
+        # register new commands, their classes are imported the first time they are used
+        for command, subcmds in commands.items():
+            if command not in self.registry.commands:
+                # noinspection PyTypeChecker
+                _attach_command(self.registry.add(command, subcmds))
 
         # TODO: load commands with prefix "challenges"
 
-        if DTShell.errors_loading:
-            msg = """
-
-
-            !   Could not load commands.
-
-                %s
-
-            !   To recover, you might want to delete the directory
-            !
-            !      ~/.dt-shell/commands-multi
-            !
-            !
-
-            """ % "\n\n".join(
-                DTShell.errors_loading
-            )
+    @property
+    def commands(self) -> Dict[str, CommandNode]:
+        return self.registry.commands
 
-            time.sleep(1)
-            dtslogger.error(msg)
-            time.sleep(5)
+    def _command_modified(self, node: CommandNode) -> bool:
+        """Checks whether the files of an imported command changed since they were imported."""
+        loaded = [n.loaded_at for n in node.walk() if n.loaded_at]
+        if not loaded:
+            # nothing was imported, there is nothing to reload
+            return False
+        return _modified_since(join(self.commands_path, node.name), min(loaded))
+
+    def _unload_command(self, command: str) -> None:
+        for a in ["do_", "complete_", "help_"]:
+            if hasattr(DTShell, a + command):
+                delattr(DTShell, a + command)
+        self.registry.remove(command)
+        self.completion_cache.clear()
+        # forget the modules of the command so that they are imported again next time
+        _forget_modules(join(self.loaded_tree or self.commands_path, command), command)
+
+    def preload_commands(self):
+        """Imports all the installed commands now instead of the first time they are used."""
+        for node in self.registry.root.walk():
+            node.load()
 
     def enable_command(self, command_name):
         if command_name in self.core_commands:
@@ -212,8 +318,8 @@ class DTShell(Cmd):
         present = res.keys() if res is not None else []
         # enable if possible
         if command_name in present:
-            flag_file = join(self.commands_path, command_name, "installed.user.flag")
-            _touch(flag_file)
+            set_user_installed(self.commands_path, command_name, True)
+            update_completion_scripts(self.commands_path)
         return True
 
     def disable_command(self, command_name):
@@ -224,89 +330,14 @@ class DTShell(Cmd):
         present = res.keys() if res is not None else []
         # enable if possible
         if command_name in present:
-            flag_file = join(self.commands_path, command_name, "installed.user.flag")
-            remove(flag_file)
+            set_user_installed(self.commands_path, command_name, False)
+            # installed by an older version of the shell
+            flag_file = join(self.commands_path, command_name, USER_FLAG)
+            if exists(flag_file):
+                remove(flag_file)
+            update_completion_scripts(self.commands_path)
         return True
 
-    def _load_commands(self, package, command, sub_commands: Optional[Mapping[str, object]], lvl):
-        # load command
-        klass = None
-        error_loading = False
-        if not sub_commands:
-            spec = package + command + ".command.DTCommand"
-            try:
-                klass = _load_class(spec)
-                # add loaded class to DTShell.include.<cmd_path>
-                klass_path = [p for p in package.split(".") if len(p)]
-                base = DTShell.include
-                for p in klass_path:
-                    if not hasattr(base, p):
-                        setattr(base, p, types.SimpleNamespace())
-                    base = getattr(base, p)
-                setattr(base, command, klass)
-            except UserError:
-                raise
-            except KeyboardInterrupt:
-                raise
-            except BaseException as e:
-                # error_loading = True
-                from .utils import format_exception
-
-                se = format_exception(e)
-
-                msg = "Cannot load command class %r (package=%r, command=%r): %s" % (
-                    spec,
-                    package,
-                    command,
-                    se,
-                )
-                # msg += ' sys.path: %s' % sys.path
-                DTShell.errors_loading.append(msg)
-                return
-
-        # handle loading error and wrong class
-        if error_loading:
-            klass = DTCommandPlaceholder()
-            if DEBUG:
-                dtslogger.debug(
-                    "ERROR while loading the command `%s`" % (package + command + ".command.DTCommand",)
-                )
-        if not issubclass(klass.__class__, DTCommandAbs.__class__):
-            klass = DTCommandPlaceholder()
-            if DEBUG:
-                dtslogger.debug("Command `%s` not found" % (package + command + ".command.DTCommand",))
-        # initialize list of subcommands
-        klass.name = command
-        klass.level = lvl
-        klass.commands = {}
-        # attach first-level commands to the shell
-        if lvl == 0:
-            do_command = getattr(klass, "do_command")
-            complete_command = getattr(klass, "complete_command")
-            help_command = getattr(klass, "help_command")
-            # wrap [klass, function] around a lambda function
-            do_command_lam = lambda s, w: do_command(klass, s, w)
-            complete_command_lam = lambda s, w, l, i, _: complete_command(klass, s, w, l, i, _)
-            help_command_lam = lambda s: help_command(klass, s)
-            # add functions do_* and complete_* to the shell
-            setattr(DTShell, "do_" + command, do_command_lam)
-            setattr(DTShell, "complete_" + command, complete_command_lam)
-            setattr(DTShell, "help_" + command, help_command_lam)
-
-        # stop recursion if there is no subcommand
-        if sub_commands is None:
-            return
-        # load sub-commands
-        for cmd, subcmds in sub_commands.items():
-            if DEBUG:
-                dtslogger.debug("Searching %s at level %d" % (package + command + ".*", lvl))
-            # noinspection PyTypeChecker
-            kl = self._load_commands(package + command + ".", cmd, subcmds, lvl + 1)
-            if kl is not None:
-                klass.commands[cmd] = kl
-        # return class for this command
-        return klass
-
     def get_dt1_token(self) -> str:
         var = DTShellConstants.DT1_TOKEN_CONFIG_KEY
         from_env = os.environ.get(var, None)
@@ -352,30 +383,67 @@ class DTShell(Cmd):
         return content
 
     def update_commands(self) -> bool:
+        commands_path = self.local_commands_info.commands_path
         # check that the repo is initialized in the commands path
-        _ensure_commands_exist(self.commands_path, self.repo_info)
+        _ensure_commands_exist(commands_path, self.repo_info)
         # update the commands if they are outdated
-        return _ensure_commands_updated(self.commands_path, self.repo_info)
+        updated = _ensure_commands_updated(commands_path, self.repo_info)
+        # the update might have activated a new tree of commands
+        self._lease_commands(commands_path)
+        return updated
 
+    def _lease_commands(self, commands_path: str) -> None:
+        # keep using the same tree of commands, even if an update is activated while the shell runs
+        lease = self.commands_lease
+        self.commands_path, self.commands_lease = lease_tree(commands_path)
+        if lease is not None:
+            # the commands imported from the previous tree are still in use until they are reloaded
+            self.stale_leases.append(lease)
 
-def _touch(path: str) -> None:
-    with open(path, "a"):
-        utime(path, None)
 
+# commands implemented by the shell itself
+_BUILTIN_COMMANDS = [name[3:] for name in dir(DTShell) if name.startswith("do_")]
 
-def _load_class(name):
-    if DEBUG:
-        dtslogger.debug("Loading class %s" % name)
-    components = name.split(".")
 
-    mod = __import__(components[0])
+def _attach_command(node: CommandNode) -> None:
+    """Adds the functions do_*, complete_* and help_* for a first-level command to the shell.
 
-    for comp in components[1:]:
-        try:
-            mod = getattr(mod, comp)
-        except AttributeError as e:
-            msg = "Could not get field %r of module %r: %s" % (comp, mod.__name__, e)
-            msg += "\t\n - Module file %s;" % getattr(mod, "__file__", "?")
-            msg += "\t\n - Module content %s;" % list(vars(mod).keys())
-            raise AttributeError(msg)
-    return mod
+    The command class is only imported when one of them is called.
+    """
+    command = node.name
+
+    def do_command_lam(s, w):
+        return node.do_command(s, w)
+
+    def complete_command_lam(s, w, l, i, _):
+        return node.complete_command(s, w, l, i, _)
+
+    def help_command_lam(s):
+        return node.help_command(s)
+
+    setattr(DTShell, "do_" + command, do_command_lam)
+    setattr(DTShell, "complete_" + command, complete_command_lam)
+    setattr(DTShell, "help_" + command, help_command_lam)
+
+
+def _forget_modules(directory: str, package: Optional[str] = None) -> None:
+    """Removes the modules imported from `directory` (only `package` and its sub-modules, if given)."""
+    directory = os.path.abspath(directory)
+    for name, module in list(sys.modules.items()):
+        if package is not None and name != package and not name.startswith(package + "."):
+            continue
+        location = getattr(module, "__file__", None) or next(iter(getattr(module, "__path__", [])), None)
+        if location and os.path.abspath(location).startswith(directory + os.sep):
+            del sys.modules[name]
+
+
+def _modified_since(path: str, since: float) -> bool:
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [d for d in dirs if d != "__pycache__" and not d.startswith(".")]
+        for p in [root] + [join(root, f) for f in files]:
+            try:
+                if os.stat(p).st_mtime >= since:
+                    return True
+            except OSError:
+                return True
+    return False
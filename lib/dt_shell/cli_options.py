@@ -2,6 +2,7 @@ import argparse
 from dataclasses import dataclass
 from typing import List, Optional, Tuple
 
+from .completion_scripts import COMPLETION_SHELLS
 from .constants import ALLOWED_BRANCHES
 
 __all__ = ["CLIOptions", "get_cli_options"]
@@ -12,6 +13,9 @@ class CLIOptions:
     debug: bool
     set_version: Optional[str]
     quiet: bool
+    server: bool
+    profile_startup: bool
+    completion: Optional[str]
 
 
 def get_cli_options(args: List[str]) -> Tuple[CLIOptions, List[str]]:
@@ -19,11 +23,32 @@ def get_cli_options(args: List[str]) -> Tuple[CLIOptions, List[str]]:
     allowed_branches = [b.split("(")[0] for b in ALLOWED_BRANCHES]
 
     if args and not args[0].startswith("-"):
-        return CLIOptions(debug=False, set_version=None, quiet=False), args
+        options = CLIOptions(
+            debug=False, set_version=None, quiet=False, server=False, profile_startup=False, completion=None
+        )
+        return options, args
     parser = argparse.ArgumentParser()
 
     parser.add_argument("--debug", action="store_true", default=False, help="More debug information")
     parser.add_argument("-q", "--quiet", action="store_true", default=False, help="Quiet execution")
+    parser.add_argument(
+        "--server",
+        action="store_true",
+        default=False,
+        help="Keep an initialized shell running in the foreground and let other dts calls run in it",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        default=False,
+        help="Report where the startup time goes (and save it as JSON)",
+    )
+    parser.add_argument(
+        "--completion",
+        choices=COMPLETION_SHELLS,
+        default=None,
+        help="Generate the script that completes the dts commands in the given shell",
+    )
     parser.add_argument(
         "--set-version",
         type=str,
@@ -35,4 +60,14 @@ def get_cli_options(args: List[str]) -> Tuple[CLIOptions, List[str]]:
 
     parsed, others = parser.parse_known_args(args)
 
-    return CLIOptions(debug=parsed.debug, set_version=parsed.set_version, quiet=parsed.quiet), others
+    return (
+        CLIOptions(
+            debug=parsed.debug,
+            set_version=parsed.set_version,
+            quiet=parsed.quiet,
+            server=parsed.server,
+            profile_startup=parsed.profile_startup,
+            completion=parsed.completion,
+        ),
+        others,
+    )
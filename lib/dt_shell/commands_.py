@@ -1,33 +1,67 @@
-import glob
-import json
 import os
-import time
-from os.path import getmtime
 from typing import Dict, Optional
 
 from . import dtslogger
+from .bytecode import precompile_commands
+from .commands_index import get_commands_index
+from .commands_trees import activate_tree
 from .config import remoteurl_from_RepoInfo, RepoInfo
+from .constants import DTShellConstants
 from .exceptions import UserError
 from .logging import dts_print
-from .update_utils import update_cached_commands
-from .utils import run_cmd
+from .update_utils import fetch_commands, get_update_lock_file, stage_commands, update_cached_commands
+from .utils import file_lock
 
 
 class InvalidRemote(Exception):
     pass
 
 
+# arguments of `git fetch` and `git submodule update` for the ways the commands can be cloned
+CLONE_ARGS = {
+    "shallow": ["--depth", "1"],
+    "blobless": ["--filter=blob:none"],
+    "full": [],
+}
+
+
 def _init_commands(commands_path: str, repo_info: RepoInfo) -> bool:
     """Raises InvalidRemote if it cannot find it"""
-    try:
-        dtslogger.info("Downloading Duckietown shell commands in %s ..." % commands_path)
-        # clone the repo
-        remote_url = remoteurl_from_RepoInfo(repo_info)
-        run_cmd(["git", "clone", "-b", repo_info.branch, "--recurse-submodules", remote_url, commands_path])
-    except Exception as e:
-        # Excepts as InvalidRemote
-        dtslogger.error(f"Unable to clone the repo at '{remote_url}'. {str(e)}.")
-        return False
+    remote_url = remoteurl_from_RepoInfo(repo_info)
+    mode = get_clone_mode()
+    with file_lock(get_update_lock_file(commands_path)):
+        # another process might have downloaded them while we were waiting
+        if os.path.exists(commands_path):
+            return True
+        try:
+            dtslogger.info("Downloading Duckietown shell commands in %s ..." % commands_path)
+            # the git objects are shared by all the versions of the commands, only the missing ones are
+            # downloaded; if the download is interrupted, the next attempt resumes from there
+            sha = fetch_commands(commands_path, repo_info, CLONE_ARGS[mode])
+            tree = stage_commands(commands_path, sha, CLONE_ARGS[mode])
+            activate_tree(commands_path, tree)
+        except Exception as e:
+            # Excepts as InvalidRemote
+            dtslogger.error(f"Unable to clone the repo at '{remote_url}'. {str(e)}.")
+            return False
+    # compile the commands now, so that their first run is as fast as the following ones
+    precompile_commands(commands_path)
+    return True
+
+
+def get_clone_mode() -> str:
+    """Returns how the commands are cloned, set with the env. variable DTSHELL_CLONE.
+
+    - shallow (default): only the last commit, of the repository and of its submodules;
+    - blobless: all the commits, the content of the files is only downloaded for the checked out ones;
+    - full: everything.
+    """
+    V = DTShellConstants.ENV_CLONE
+    mode = os.environ.get(V, "shallow")
+    if mode not in CLONE_ARGS:
+        dtslogger.warning(f"Ignoring invalid value {mode!r} of the env. variable {V}.")
+        mode = "shallow"
+    return mode
 
 
 def _ensure_commands_exist(commands_path: str, repo_info: RepoInfo) -> bool:
@@ -43,27 +77,6 @@ def _ensure_commands_updated(commands_path: str, repo_info: RepoInfo) -> bool:
     return update_cached_commands(commands_path, repo_info)
 
 
-def _get_commands(path: str, lvl=0, all_commands=False) -> Optional[Dict[str, object]]:
-    entries = glob.glob(os.path.join(path, "*"))
-    files = [os.path.basename(e) for e in entries if os.path.isfile(e)]
-    dirs = [e for e in entries if os.path.isdir(e) and (lvl > 0 or os.path.basename(e) != "lib")]
-    # base case: empty dir
-    if "command.py" not in files and not dirs:
-        return None
-    if (
-        not all_commands
-        and lvl == 1
-        and ("installed.flag" not in files and "installed.user.flag" not in files)
-    ):
-        return None
-    # check subcommands
-    subcmds = {}
-    for d in dirs:
-        f = _get_commands(d, lvl + 1, all_commands)
-        if f is not None:
-            subcmds[os.path.basename(d)] = f
-    # return
-    if "command.py" not in files and not subcmds:
-        return None
-    # ---
-    return subcmds
+def _get_commands(path: str, all_commands=False) -> Optional[Dict[str, object]]:
+    index = get_commands_index(path)
+    return index.get_commands(all_commands=all_commands)
@@ -0,0 +1,243 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set
+
+from . import dtslogger
+from .config import get_config_path
+from .git_refs import get_head_sha
+from .state import get_commands_state, update_commands_state
+
+__all__ = ["CommandsIndex", "get_commands_index", "get_user_installed", "set_user_installed"]
+
+# bump this whenever the format of the index file changes
+INDEX_VERSION = 3
+
+# the commands installed by the user are recorded in the state, older versions of the shell used a flag
+USER_FLAG = "installed.user.flag"
+INSTALLED_FLAGS = ["installed.flag", USER_FLAG]
+
+# files that can be imported as modules (the exact suffix is checked by the import system)
+MODULE_SUFFIXES = (".py", ".pyc", ".so", ".pyd")
+
+
+@dataclass
+class CommandsIndex:
+    commands_path: str
+    # SHA of HEAD in the commands repo (None if it is not a git repo)
+    sha: Optional[str]
+    # modification time (ns) of every directory visited while walking the tree, keyed by relative path
+    mtimes: Dict[str, int]
+    # full tree of commands (installed or not), nested dictionaries of sub-commands
+    commands: Dict[str, object]
+    # first-level commands that are marked as installed
+    installed: List[str]
+    # whether the root of the tree is itself a command
+    root_command: bool
+    # top-level modules/packages importable from the tree (and its `lib`), and the directory containing them
+    modules: Dict[str, str]
+
+    def get_commands(self, all_commands: bool = False) -> Optional[Dict[str, object]]:
+        """Returns the tree of (installed) commands, as `_get_commands` would compute it."""
+        if all_commands:
+            commands = self.commands
+        else:
+            installed = set(self.installed).union(get_user_installed(self.commands_path))
+            commands = {k: v for k, v in self.commands.items() if k in installed}
+        if not commands and not self.root_command:
+            return None
+        return commands
+
+    def is_valid(self) -> bool:
+        """Checks whether the tree on disk still looks like the one this index was built from."""
+        if self.sha != _read_head_sha(self.commands_path):
+            return False
+        for rel, mtime in self.mtimes.items():
+            try:
+                st = os.stat(os.path.join(self.commands_path, rel))
+            except OSError:
+                return False
+            if st.st_mtime_ns != mtime:
+                return False
+        return True
+
+    def as_dict(self) -> dict:
+        return {
+            "version": INDEX_VERSION,
+            "commands_path": self.commands_path,
+            "sha": self.sha,
+            "mtimes": self.mtimes,
+            "commands": self.commands,
+            "installed": self.installed,
+            "root_command": self.root_command,
+            "modules": self.modules,
+        }
+
+
+def get_commands_index(commands_path: str) -> CommandsIndex:
+    """Returns the index of the commands tree in `commands_path`.
+
+    The index is read from disk when the tree did not change since it was built,
+    it is rebuilt (and saved) otherwise.
+    """
+    commands_path = os.path.abspath(commands_path)
+    index_file = get_commands_index_file(commands_path)
+    index = _read_index(index_file, commands_path)
+    if index is not None and index.is_valid():
+        return index
+    dtslogger.debug(f"Indexing commands in '{commands_path}'...")
+    index = build_commands_index(commands_path)
+    _write_index(index_file, index)
+    return index
+
+
+def get_user_installed(commands_path: str) -> List[str]:
+    """Returns the first-level commands the user installed (with `dts install`)."""
+    return get_commands_state(commands_path).get("user-installed", [])
+
+
+def set_user_installed(commands_path: str, command: str, installed: bool) -> None:
+    if installed:
+        _update_user_installed(commands_path, lambda names: names | {command})
+    else:
+        _update_user_installed(commands_path, lambda names: names - {command})
+
+
+def import_user_flags(tree: str) -> None:
+    """Records the commands installed by older versions of the shell (with a flag file) in the state."""
+    try:
+        names = [name for name in os.listdir(tree) if os.path.isfile(os.path.join(tree, name, USER_FLAG))]
+    except OSError:
+        return
+    if not set(names).issubset(get_user_installed(tree)):
+        _update_user_installed(tree, lambda installed: installed.union(names))
+
+
+def _update_user_installed(commands_path: str, f: Callable[[Set[str]], Set[str]]) -> None:
+    def update(commands: dict) -> None:
+        commands["user-installed"] = sorted(f(set(commands.get("user-installed", []))))
+
+    update_commands_state(commands_path, update)
+
+
+def get_commands_index_file(commands_path: str) -> str:
+    key = hashlib.sha1(commands_path.encode("utf-8")).hexdigest()
+    return os.path.join(get_config_path(), "commands-index", f"{key}.json")
+
+
+def build_commands_index(commands_path: str) -> CommandsIndex:
+    mtimes: Dict[str, int] = {}
+    installed: List[str] = []
+    # we need the SHA before walking so that a concurrent update invalidates the index
+    sha = _read_head_sha(commands_path)
+    root = _walk_commands(commands_path, commands_path, 0, mtimes, installed)
+    # third-party libraries take precedence over the commands
+    modules: Dict[str, str] = {}
+    for location in [commands_path, os.path.join(commands_path, "lib")]:
+        names = _find_modules(location)
+        if names is None:
+            continue
+        mtimes[os.path.relpath(location, commands_path)] = os.stat(location).st_mtime_ns
+        # `lib` is where the libraries are, not a library
+        modules.update({name: location for name in names if location != commands_path or name != "lib"})
+    return CommandsIndex(
+        commands_path=commands_path,
+        sha=sha,
+        mtimes=mtimes,
+        commands=root.subcommands if root else {},
+        installed=installed,
+        root_command=root.has_command if root else False,
+        modules=modules,
+    )
+
+
+@dataclass
+class _Node:
+    has_command: bool
+    subcommands: Dict[str, object]
+
+
+def _walk_commands(
+    root: str, path: str, lvl: int, mtimes: Dict[str, int], installed: List[str]
+) -> Optional[_Node]:
+    try:
+        mtimes[os.path.relpath(path, root)] = os.stat(path).st_mtime_ns
+        with os.scandir(path) as it:
+            entries = [e for e in it if not e.name.startswith(".")]
+    except OSError:
+        return None
+    files = [e.name for e in entries if e.is_file()]
+    dirs = [
+        e.path for e in entries if e.is_dir() and e.name != "__pycache__" and (lvl > 0 or e.name != "lib")
+    ]
+    # base case: empty dir
+    if "command.py" not in files and not dirs:
+        return None
+    # check subcommands
+    subcmds = {}
+    for d in sorted(dirs):
+        f = _walk_commands(root, d, lvl + 1, mtimes, installed)
+        if f is not None:
+            subcmds[os.path.basename(d)] = f.subcommands
+    if "command.py" not in files and not subcmds:
+        return None
+    # keep track of the first-level commands that are installed
+    if lvl == 1 and any(flag in files for flag in INSTALLED_FLAGS):
+        installed.append(os.path.basename(path))
+    # ---
+    return _Node(has_command="command.py" in files, subcommands=subcmds)
+
+
+def _find_modules(location: str) -> Optional[List[str]]:
+    """Returns the names of the top-level modules and packages in a directory."""
+    try:
+        with os.scandir(location) as it:
+            entries = list(it)
+    except OSError:
+        return None
+    names = []
+    for e in entries:
+        name = e.name.split(".")[0] if e.is_file() else e.name
+        if not name.isidentifier():
+            continue
+        if e.is_dir() or e.name.endswith(MODULE_SUFFIXES):
+            names.append(name)
+    return names
+
+
+def _read_index(index_file: str, commands_path: str) -> Optional[CommandsIndex]:
+    if not os.path.isfile(index_file):
+        return None
+    try:
+        with open(index_file, "r") as fp:
+            data = json.load(fp)
+        if data.pop("version", None) != INDEX_VERSION:
+            return None
+        index = CommandsIndex(**data)
+    except (ValueError, TypeError, OSError) as e:
+        dtslogger.debug(f"Ignoring invalid commands index '{index_file}': {e}")
+        return None
+    if index.commands_path != commands_path:
+        return None
+    return index
+
+
+def _write_index(index_file: str, index: CommandsIndex) -> None:
+    try:
+        os.makedirs(os.path.dirname(index_file), exist_ok=True)
+        tmp_file = f"{index_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as fp:
+            json.dump(index.as_dict(), fp)
+        os.replace(tmp_file, index_file)
+    except OSError as e:
+        # not being able to cache the index is not fatal
+        dtslogger.debug(f"Could not write the commands index '{index_file}': {e}")
+
+
+def _read_head_sha(repo_path: str) -> Optional[str]:
+    try:
+        return get_head_sha(repo_path)
+    except RuntimeError as e:
+        dtslogger.debug(f"Cannot read HEAD of '{repo_path}': {e}")
+        return None
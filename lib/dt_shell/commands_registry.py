@@ -0,0 +1,308 @@
+import importlib
+import shlex
+import time
+from typing import Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+from . import dtslogger
+from .constants import DEBUG
+from .completion import PrefixTrie
+from .dt_command_abs import DTCommandAbs
+from .dt_command_placeholder import DTCommandPlaceholder
+from .exceptions import UserError
+from .profiling import profile_phase
+
+__all__ = ["CommandNode", "CommandsRegistry", "CommandsNamespace"]
+
+
+class CommandNode:
+    """A command (or a group of sub-commands) in the registry of the shell.
+
+    Leaf nodes import their class the first time it is needed, nodes with children are groups
+    of sub-commands and do not have a class of their own.
+    """
+
+    __slots__ = ("registry", "name", "path", "parent", "children", "loaded_at", "_klass", "_failed", "_trie")
+
+    def __init__(self, registry: "CommandsRegistry", name: str, parent: Optional["CommandNode"]):
+        self.registry = registry
+        self.name = name
+        self.path: Tuple[str, ...] = parent.path + (name,) if parent is not None else ()
+        self.parent = parent
+        self.children: Dict[str, "CommandNode"] = {}
+        # time at which the class was imported
+        self.loaded_at: Optional[float] = None
+        self._klass: Optional[type] = None
+        self._failed = False
+        # names of the children, built the first time they are completed
+        self._trie: Optional[PrefixTrie] = None
+
+    @property
+    def level(self) -> int:
+        return len(self.path) - 1
+
+    @property
+    def spec(self) -> str:
+        return ".".join(self.path) + ".command.DTCommand"
+
+    @property
+    def is_group(self) -> bool:
+        return len(self.children) > 0
+
+    @property
+    def completions(self) -> PrefixTrie:
+        if self._trie is None:
+            self._trie = PrefixTrie(self.children)
+        return self._trie
+
+    def find(self, path: Sequence[str]) -> Optional["CommandNode"]:
+        node = self
+        for name in path:
+            node = node.children.get(name)
+            if node is None:
+                return None
+        return node
+
+    def walk(self) -> Iterator["CommandNode"]:
+        yield self
+        for child in self.children.values():
+            yield from child.walk()
+
+    def as_tree(self) -> Dict[str, object]:
+        """Returns the sub-commands in the same format of the commands index."""
+        return {name: child.as_tree() for name, child in self.children.items()}
+
+    def load(self) -> Optional[type]:
+        """Returns the command class, or None if it could not be loaded."""
+        if self.is_group or self._klass is not None or self._failed:
+            return self._klass
+        self.loaded_at = time.time()
+        try:
+            with profile_phase(f"import {self.spec}"):
+                klass = _load_class(self.spec)
+        except UserError:
+            raise
+        except KeyboardInterrupt:
+            raise
+        except BaseException as e:
+            from .utils import format_exception
+
+            se = format_exception(e)
+            msg = "Cannot load command class %r (command=%r): %s" % (self.spec, " ".join(self.path), se)
+            self.registry.errors.append(msg)
+            dtslogger.error(loading_errors_message([msg]))
+            self._failed = True
+            return None
+        self._klass = klass
+        self.registry._nodes_by_class[klass] = self
+        return klass
+
+    def get_class(self) -> type:
+        """Returns the command class, or a placeholder for groups and commands that could not be loaded."""
+        klass = self.load()
+        if klass is None or not issubclass(klass.__class__, DTCommandAbs.__class__):
+            if DEBUG and not self.is_group:
+                dtslogger.debug("Command `%s` not found" % (self.spec,))
+            return DTCommandPlaceholder
+        return klass
+
+    def do_command(self, shell, line: str):
+        """Runs the command with the arguments in `line`, split with the quoting rules of a POSIX shell."""
+        try:
+            args = shlex.split(line)
+        except ValueError as e:
+            print(f"Cannot parse the command line: {e}")
+            return
+        from .utils import undo_replace_spaces
+
+        # callers might still encode the spaces in the arguments with SPACE_TAG
+        self.run(shell, [undo_replace_spaces(a) for a in args])
+
+    def run(self, shell, args: List[str]):
+        """Runs the (sub-)command selected by the first arguments, the others are passed to it untouched."""
+        node = self
+        i = 0
+        while node.is_group:
+            if i == len(args):
+                print("Available sub-commands are:\n\n\t%s" % "\n\t".join(node.children))
+                return
+            child = node.children.get(args[i])
+            if child is None:
+                print(
+                    "Command `%s` not recognized.\nAvailable sub-commands are:\n\n\t%s"
+                    % (args[i].strip(), "\n\t".join(node.children))
+                )
+                return
+            node = child
+            i += 1
+        args = args[i:]
+        klass = node.get_class()
+        if args or not klass.fake:
+            klass.command(shell, args)
+
+    def complete_command(self, shell, word: str, line: str, start_index: int, end_index: int) -> List[str]:
+        word = word.strip()
+        # the line is tokenized once, the word being completed is not part of the command path
+        tokens = line.split()
+        if word and tokens:
+            tokens.pop()
+        if not tokens or tokens[0] != self.name:
+            return []
+        # only the word right after a (sub-)command is completed
+        node = self
+        for token in tokens[1:]:
+            node = node.children.get(token)
+            if node is None:
+                return []
+        # commands see the line starting from their own name
+        line = " ".join(tokens[len(node.path) - len(self.path) :] + ([word] if word else []))
+        static_comp = [] if node.is_group else node.complete(shell, word, line)
+        return static_comp + node.completions.find(word)
+
+    def complete(self, shell, word: str, line: str) -> List[str]:
+        """Returns the completions of `word` provided by the command class (`line` ends with `word`).
+
+        The shell caches them (if it has a cache). Commands whose completions do not depend on the word
+        (`completions_by_line`) are asked for the line without the word instead, the shell filters
+        those locally while the word is being typed.
+        """
+        klass = self.get_class()
+        if getattr(klass, "completions_by_line", False):
+            if word and line.endswith(word):
+                line = line[: -len(word)].rstrip()
+            key, args = (self.path, line), ("", line)
+        else:
+            key, args = (self.path, line, word), (word, line)
+        cache = getattr(shell, "completion_cache", None)
+        if cache is None:
+            completions = klass.complete(shell, *args)
+        else:
+            completions = cache.get(key, lambda: klass.complete(shell, *args))
+        return [c for c in completions if c.startswith(word)]
+
+    def help_command(self, shell):
+        klass = self.get_class()
+        msg = klass.help if (self.level == 0 and klass.help is not None) else str(shell.nohelp % self.name)
+        print(msg)
+
+    def __repr__(self):
+        return "CommandNode(%r)" % " ".join(self.path)
+
+
+class CommandsRegistry:
+    """The tree of commands registered in the shell."""
+
+    def __init__(self):
+        self.root = CommandNode(self, "", None)
+        self.include = CommandsNamespace(self.root)
+        # errors encountered while importing the commands
+        self.errors: List[str] = []
+        self._nodes_by_class: Dict[type, CommandNode] = {}
+
+    @property
+    def commands(self) -> Dict[str, CommandNode]:
+        """The first-level commands."""
+        return self.root.children
+
+    def find(self, path: Sequence[str]) -> Optional[CommandNode]:
+        return self.root.find(path)
+
+    def add(self, name: str, sub_commands: Optional[Mapping[str, object]]) -> CommandNode:
+        """Registers a first-level command and its sub-commands (as given by the commands index)."""
+        return self._add(self.root, name, sub_commands)
+
+    def _add(
+        self, parent: CommandNode, name: str, sub_commands: Optional[Mapping[str, object]]
+    ) -> CommandNode:
+        node = CommandNode(self, name, parent)
+        parent.children[name] = node
+        parent._trie = None
+        for child, children in (sub_commands or {}).items():
+            # noinspection PyTypeChecker
+            self._add(node, child, children)
+        return node
+
+    def remove(self, name: str) -> Optional[CommandNode]:
+        node = self.root.children.pop(name, None)
+        if node is not None:
+            self.root._trie = None
+            for n in node.walk():
+                if n._klass is not None and self._nodes_by_class.get(n._klass) is n:
+                    del self._nodes_by_class[n._klass]
+        return node
+
+    def node_of(self, klass: type) -> Optional[CommandNode]:
+        """Returns the node a command class was loaded for."""
+        return self._nodes_by_class.get(klass)
+
+
+class CommandsNamespace:
+    """View of (a group of) the registry as attributes, command classes are imported on access.
+
+    This is what commands see as `shell.include`, e.g., `shell.include.devel.build`.
+    """
+
+    __slots__ = ("_node",)
+
+    def __init__(self, node: CommandNode):
+        self._node = node
+
+    def __getattr__(self, name: str):
+        child = self._node.children.get(name)
+        if child is None:
+            raise AttributeError(name)
+        if child.is_group:
+            return CommandsNamespace(child)
+        klass = child.load()
+        if klass is None:
+            raise AttributeError("Command class %r could not be loaded." % child.spec)
+        return klass
+
+    def __dir__(self):
+        return list(self._node.children)
+
+
+def detached_node(klass: type) -> CommandNode:
+    """A node for a command class that is not in any registry (e.g., used directly)."""
+    node = CommandNode(CommandsRegistry(), klass.name or klass.__name__, None)
+    node.path = (node.name,)
+    node._klass = klass
+    return node
+
+
+def loading_errors_message(errors: List[str]) -> str:
+    return """
+
+
+            !   Could not load commands.
+
+                %s
+
+            !   To recover, you might want to update the commands with
+            !
+            !      dts update
+            !
+            !   If they are still broken, delete the tree they are checked out in (the one
+            !   ~/.dt-shell/commands-multi/<version> points to), it is downloaded again:
+            !
+            !      ~/.dt-shell/commands-multi/.trees/<version>/<commit>
+            !
+
+            """ % "\n\n".join(
+        errors
+    )
+
+
+def _load_class(name):
+    if DEBUG:
+        dtslogger.debug("Loading class %s" % name)
+    # import only the module defining the class (and its parent packages)
+    module_name, _, klass_name = name.rpartition(".")
+    mod = importlib.import_module(module_name)
+
+    try:
+        return getattr(mod, klass_name)
+    except AttributeError as e:
+        msg = "Could not get field %r of module %r: %s" % (klass_name, mod.__name__, e)
+        msg += "\t\n - Module file %s;" % getattr(mod, "__file__", "?")
+        msg += "\t\n - Module content %s;" % list(vars(mod).keys())
+        raise AttributeError(msg)
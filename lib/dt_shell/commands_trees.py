@@ -0,0 +1,226 @@
+import importlib.util
+import os
+import shutil
+from typing import Callable, IO, Optional, Tuple
+
+from . import dtslogger
+from .git_refs import find_git_dir, get_head_sha
+from .utils import file_lock, run_cmd
+
+__all__ = [
+    "get_objects_store",
+    "init_objects_store",
+    "checkout_tree",
+    "get_trees_dir",
+    "is_double_buffered",
+    "get_staging_tree",
+    "migrate_commands_tree",
+    "activate_tree",
+    "lease_tree",
+    "collect_trees",
+    "get_commands_link",
+]
+
+# the commands of a version live in trees, `.trees/<version>/<commit>`, next to `<version>`, a symlink to
+# the active one; updates are staged in a new tree and activated by flipping the symlink
+TREES_DIR = ".trees"
+# characters of the SHA of the commit in the names of the trees
+TREE_SHA_CHARS = 12
+
+# the processes using a tree hold a shared lock on this file (next to the tree), the trees that are
+# neither active nor leased are removed
+LEASE_SUFFIX = ".lease"
+# attempts at leasing the active tree while updates flip the symlink
+LEASE_TRIES = 10
+# the leases are advisory locks, without them (e.g., on Windows) the trees are never removed nor reused
+CAN_LEASE = importlib.util.find_spec("fcntl") is not None
+
+# the trees (of all the versions) are worktrees of this bare repository, which holds all the git objects
+OBJECTS_DIR = ".objects"
+
+
+def get_objects_store(commands_path: str) -> str:
+    commands_path = os.path.abspath(commands_path.rstrip(os.sep))
+    return os.path.join(os.path.dirname(commands_path), OBJECTS_DIR)
+
+
+def init_objects_store(commands_path: str, remote_url: str, branch: str) -> str:
+    """Creates the object store shared by all the versions of the commands (if needed), returns it.
+
+    The objects of a tree that is not a worktree of the store (e.g., cloned by an older version of the
+    shell) are copied into the store, so that they are not downloaded again.
+    """
+    store = get_objects_store(commands_path)
+    git = ["git", "-C", store]
+    if not os.path.isdir(store):
+        run_cmd(["git", "init", "-q", "--bare", store])
+        run_cmd(git + ["config", "remote.origin.url", remote_url])
+    active = os.path.realpath(commands_path)
+    if find_git_dir(active) is not None and not _is_worktree_of(active, store):
+        dtslogger.debug(f"Copying the git objects of '{active}' to '{store}'.")
+        seed = ["fetch", "-q", "--no-tags", "--update-shallow", active, f"+HEAD:refs/remotes/origin/{branch}"]
+        run_cmd(git + seed, suppress_errors=True)
+    return store
+
+
+def checkout_tree(commands_path: str, tree: str, sha: str) -> None:
+    """Checks out the commit `sha` of the object store in `tree`, discarding whatever was there."""
+    store = get_objects_store(commands_path)
+    if not _is_worktree_of(tree, store):
+        shutil.rmtree(tree, ignore_errors=True)
+        run_cmd(["git", "-C", store, "worktree", "prune"])
+        os.makedirs(os.path.dirname(tree), exist_ok=True)
+        run_cmd(["git", "-C", store, "worktree", "add", "-q", "--detach", "--no-checkout", tree, sha])
+    git = ["git", "-C", tree]
+    # the trees are detached, a branch can be checked out in one worktree only
+    run_cmd(git + ["checkout", "-q", "-f", "--detach", sha])
+    run_cmd(git + ["clean", "-q", "-ffdx"])
+
+
+def _is_worktree_of(tree: str, store: str) -> bool:
+    git_dir = find_git_dir(tree)
+    if git_dir is None:
+        return False
+    return os.path.realpath(git_dir).startswith(os.path.realpath(store) + os.sep)
+
+
+def get_trees_dir(commands_path: str) -> str:
+    commands_path = os.path.abspath(commands_path.rstrip(os.sep))
+    return os.path.join(os.path.dirname(commands_path), TREES_DIR, os.path.basename(commands_path))
+
+
+def get_commands_link(path: str) -> str:
+    """Returns the path through which the commands in `path` are used (`path` itself if it is not a tree)."""
+    # the parent directory is resolved, the trees are found through it
+    path = os.path.abspath(path.rstrip(os.sep))
+    parent, name = os.path.realpath(os.path.dirname(path)), os.path.basename(path)
+    if os.path.basename(os.path.dirname(parent)) == TREES_DIR:
+        return os.path.join(os.path.dirname(os.path.dirname(parent)), os.path.basename(parent))
+    return os.path.join(parent, name)
+
+
+def is_double_buffered(commands_path: str) -> bool:
+    # a symlink made by the user (e.g., in DTSHELL_COMMANDS) does not count
+    if not os.path.islink(commands_path.rstrip(os.sep)):
+        return False
+    trees_dir = os.path.realpath(get_trees_dir(commands_path))
+    return os.path.dirname(os.path.realpath(commands_path)) == trees_dir
+
+
+def get_staging_tree(commands_path: str, sha: str) -> str:
+    """Returns a tree for the commit `sha` where the next update is prepared.
+
+    A tree is never reused while a process might still be using it: it must not be active nor leased.
+    """
+    active = os.path.realpath(commands_path)
+    return _new_tree(commands_path, sha, lambda tree: tree != active and not _is_leased(tree))
+
+
+def _new_tree(commands_path: str, sha: Optional[str], usable: Callable[[str], bool]) -> str:
+    trees_dir = os.path.realpath(get_trees_dir(commands_path))
+    name = sha[:TREE_SHA_CHARS] if sha else "commands"
+    tree = os.path.join(trees_dir, name)
+    i = 1
+    while not usable(tree):
+        tree = os.path.join(trees_dir, f"{name}-{i}")
+        i += 1
+    return tree
+
+
+def migrate_commands_tree(commands_path: str) -> None:
+    """Moves commands cloned in place (by older versions of the shell) into a tree."""
+    from .update_utils import get_update_lock_file
+
+    commands_path = commands_path.rstrip(os.sep)
+    if is_double_buffered(commands_path) or not os.path.isdir(commands_path):
+        return
+    with file_lock(get_update_lock_file(commands_path)):
+        # another process might have moved them while we were waiting
+        if is_double_buffered(commands_path) or os.path.islink(commands_path):
+            return
+        if not os.path.isdir(commands_path):
+            return
+        # nothing is ever removed to make room for them
+        tree = _new_tree(commands_path, get_head_sha(commands_path), lambda t: not os.path.lexists(t))
+        dtslogger.debug(f"Moving the commands in '{commands_path}' to '{tree}'.")
+        os.makedirs(os.path.dirname(tree), exist_ok=True)
+        os.rename(commands_path, tree)
+        activate_tree(commands_path, tree)
+
+
+def activate_tree(commands_path: str, tree: str) -> None:
+    """Points `commands_path` to `tree` atomically, a shell starting meanwhile sees either tree in full."""
+    commands_path = commands_path.rstrip(os.sep)
+    target = os.path.relpath(tree, os.path.dirname(os.path.abspath(commands_path)))
+    tmp = f"{commands_path}.{os.getpid()}.tmp"
+    if os.path.lexists(tmp):
+        os.remove(tmp)
+    os.symlink(target, tmp)
+    os.replace(tmp, commands_path)
+
+
+def lease_tree(commands_path: str) -> Tuple[str, Optional[IO]]:
+    """Returns the tree `commands_path` points to, and a lease on it (None if it is not a tree).
+
+    The tree is not removed as long as the lease (an open file) is not closed.
+    """
+    tree = os.path.realpath(commands_path)
+    if not CAN_LEASE or not is_double_buffered(commands_path):
+        return tree, None
+    import fcntl
+
+    for _ in range(LEASE_TRIES):
+        fp = open(tree + LEASE_SUFFIX, "a")
+        fcntl.flock(fp.fileno(), fcntl.LOCK_SH)
+        # the tree might have been replaced (and removed) before we got the lease
+        active = os.path.realpath(commands_path)
+        if active == tree and os.path.isdir(tree):
+            return tree, fp
+        fp.close()
+        tree = active
+    dtslogger.warning(f"Could not lease the commands in '{tree}', they are being updated.")
+    return tree, None
+
+
+def collect_trees(commands_path: str) -> None:
+    """Removes the trees that are neither active nor leased by a process.
+
+    It must be called holding the lock of the updates of the commands.
+    """
+    if not CAN_LEASE:
+        return
+    trees_dir = os.path.realpath(get_trees_dir(commands_path))
+    active = os.path.realpath(commands_path)
+    removed = False
+    with os.scandir(trees_dir) as it:
+        trees = [e.path for e in it if e.is_dir(follow_symlinks=False) and e.path != active]
+    for tree in trees:
+        lease_file = tree + LEASE_SUFFIX
+        with file_lock(lease_file, blocking=False) as free:
+            if not free:
+                continue
+            dtslogger.debug(f"Removing the commands in '{tree}', they are not used anymore.")
+            shutil.rmtree(tree, ignore_errors=True)
+            os.remove(lease_file)
+            _remove_commands_index(tree)
+            removed = True
+    if removed:
+        run_cmd(["git", "-C", get_objects_store(commands_path), "worktree", "prune"], suppress_errors=True)
+
+
+def _remove_commands_index(tree: str) -> None:
+    from .commands_index import get_commands_index_file
+
+    try:
+        os.remove(get_commands_index_file(tree))
+    except FileNotFoundError:
+        pass
+
+
+def _is_leased(tree: str) -> bool:
+    if not os.path.exists(tree):
+        return False
+    if not CAN_LEASE:
+        return True
+    with file_lock(tree + LEASE_SUFFIX, blocking=False) as free:
+        return not free
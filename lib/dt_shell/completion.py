@@ -0,0 +1,109 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable, List, Set, Tuple
+
+from . import dtslogger
+
+__all__ = ["PrefixTrie", "CompletionCache"]
+
+# seconds after which a cached completion is refreshed (in the background)
+COMPLETION_CACHE_TTL_SECS = 30.0
+# maximum number of completions kept in the cache
+COMPLETION_CACHE_SIZE = 256
+
+
+class PrefixTrie:
+    """Set of words that can be queried by prefix in O(len(prefix)).
+
+    Every node of the trie keeps the words below it, so a query does not walk the sub-tree.
+    Words are returned in insertion order.
+    """
+
+    __slots__ = ("_root",)
+
+    def __init__(self, words: Iterable[str] = ()):
+        self._root = _TrieNode()
+        for word in words:
+            self.add(word)
+
+    def add(self, word: str) -> None:
+        node = self._root
+        node.words.append(word)
+        for c in word:
+            child = node.children.get(c)
+            if child is None:
+                child = node.children[c] = _TrieNode()
+            node = child
+            node.words.append(word)
+
+    def find(self, prefix: str) -> List[str]:
+        node = self._root
+        for c in prefix:
+            node = node.children.get(c)
+            if node is None:
+                return []
+        return list(node.words)
+
+
+class _TrieNode:
+    __slots__ = ("children", "words")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.words: List[str] = []
+
+
+class CompletionCache:
+    """LRU cache of the completions provided by the commands, with a TTL.
+
+    The first time a completion is requested, the prompt waits for it. After that, the cached
+    completion is returned right away and, once older than the TTL, it is refreshed in a background
+    thread, so that slow providers (e.g., listing robots on the network) do not block the prompt.
+    """
+
+    def __init__(self, ttl: float = COMPLETION_CACHE_TTL_SECS, max_entries: int = COMPLETION_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (time of the computation, completions)
+        self._entries: "OrderedDict[Hashable, Tuple[float, List[str]]]" = OrderedDict()
+        self._refreshing: Set[Hashable] = set()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, compute: Callable[[], Iterable[str]]) -> List[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                stale = time.monotonic() - entry[0] > self.ttl and key not in self._refreshing
+                if stale:
+                    self._refreshing.add(key)
+        if entry is None:
+            return self._compute(key, compute)
+        if stale:
+            thread = threading.Thread(target=self._refresh, args=(key, compute), daemon=True)
+            thread.start()
+        return entry[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _compute(self, key: Hashable, compute: Callable[[], Iterable[str]]) -> List[str]:
+        value = list(compute())
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def _refresh(self, key: Hashable, compute: Callable[[], Iterable[str]]) -> None:
+        try:
+            self._compute(key, compute)
+        except BaseException as e:
+            # keep serving the old completions
+            dtslogger.debug(f"Could not refresh the completions for {key!r}: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
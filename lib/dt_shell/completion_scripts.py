@@ -0,0 +1,166 @@
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Optional
+
+from . import dtslogger
+from .commands_index import CommandsIndex, get_commands_index
+from .config import get_config_path
+
+__all__ = [
+    "COMPLETION_SHELLS",
+    "get_completion_script_file",
+    "write_completion_scripts",
+    "update_completion_scripts",
+]
+
+COMPLETION_SHELLS = ["bash", "zsh"]
+
+# completions with other characters are left out, they would need quoting
+SAFE_WORD = re.compile(r"^[\w.,:/=@+%-]+$")
+
+BASH_TEMPLATE = """\
+# bash completion for dts, generated by `dts --completion bash`
+_dts_completions() {
+    local cur cmd_path i
+    cur="${COMP_WORDS[COMP_CWORD]}"
+    cmd_path=""
+    for ((i = 1; i < COMP_CWORD; i++)); do
+        # skip the options of dts itself
+        if [[ -z "$cmd_path" && "${COMP_WORDS[i]}" == -* ]]; then
+            continue
+        fi
+        cmd_path="${cmd_path:+$cmd_path }${COMP_WORDS[i]}"
+    done
+    case "$cmd_path" in
+%(cases)s
+    esac
+}
+complete -F _dts_completions dts
+"""
+
+BASH_CASE = """        "%(path)s") COMPREPLY=($(compgen -W "%(words)s" -- "$cur")) ;;"""
+
+ZSH_TEMPLATE = """\
+#compdef dts
+# zsh completion for dts, generated by `dts --completion zsh`
+_dts() {
+    local cmd_path i
+    cmd_path=""
+    for ((i = 2; i < CURRENT; i++)); do
+        # skip the options of dts itself
+        if [[ -z "$cmd_path" && "${words[i]}" == -* ]]; then
+            continue
+        fi
+        cmd_path="${cmd_path:+$cmd_path }${words[i]}"
+    done
+    case "$cmd_path" in
+%(cases)s
+    esac
+}
+compdef _dts dts
+"""
+
+ZSH_CASE = """        "%(path)s") compadd -- %(words)s ;;"""
+
+
+def get_completion_script_file(shell_name: str) -> str:
+    return os.path.join(get_config_path(), "completion", f"dts.{shell_name}")
+
+
+def get_completion_table(registry, builtins: List[str]) -> Dict[str, List[str]]:
+    """Returns the completions of every (sub-)command path in the registry, the root path is ''.
+
+    Groups are completed with their sub-commands, commands with the words they declare in
+    `static_completions` (this imports them), their `complete()` is never called.
+    """
+    table: Dict[str, List[str]] = {}
+    for node in registry.root.walk():
+        if node.parent is None:
+            words = list(node.children) + [n for n in builtins if n not in node.children]
+        elif node.is_group:
+            words = list(node.children)
+        else:
+            klass = node.load()
+            words = list(getattr(klass, "static_completions", None) or [])
+        words = [w for w in words if isinstance(w, str) and SAFE_WORD.match(w)]
+        if words:
+            table[" ".join(node.path)] = words
+    return table
+
+
+def generate_completion_script(shell_name: str, table: Dict[str, List[str]]) -> str:
+    template, case = {"bash": (BASH_TEMPLATE, BASH_CASE), "zsh": (ZSH_TEMPLATE, ZSH_CASE)}[shell_name]
+    cases = [case % {"path": path, "words": " ".join(words)} for path, words in sorted(table.items())]
+    return template % {"cases": "\n".join(cases)}
+
+
+def write_completion_scripts(commands_path: str) -> None:
+    """Generates the completion scripts for all the supported shells from the installed commands."""
+    from .cli import _BUILTIN_COMMANDS
+    from .commands_registry import CommandsRegistry
+    from .importer import install_commands_finder
+
+    index = get_commands_index(commands_path)
+    registry = CommandsRegistry()
+    for command, subcmds in (index.get_commands() or {}).items():
+        # noinspection PyTypeChecker
+        registry.add(command, subcmds)
+    install_commands_finder(index.modules)
+    table = get_completion_table(registry, _BUILTIN_COMMANDS)
+    for shell_name in COMPLETION_SHELLS:
+        _write_file(get_completion_script_file(shell_name), generate_completion_script(shell_name, table))
+    _write_file(_get_fingerprint_file(), _get_fingerprint(index))
+
+
+def update_completion_scripts(commands_path: str) -> None:
+    """Regenerates the completion scripts in the background if the user has them (e.g., after an update).
+
+    The commands are imported by a process of their own, never by the shell that is running.
+    """
+    if not os.path.isfile(_get_fingerprint_file()):
+        return
+    cmd = [sys.executable, "-m", __name__, commands_path]
+    dtslogger.debug("Updating the completion scripts in the background.")
+    subprocess.Popen(
+        cmd,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+
+
+def main() -> None:
+    (commands_path,) = sys.argv[1:]
+    with open(_get_fingerprint_file(), "r") as fp:
+        if fp.read() == _get_fingerprint(get_commands_index(commands_path)):
+            return
+    try:
+        write_completion_scripts(commands_path)
+    except OSError as e:
+        dtslogger.warning(f"Could not update the completion scripts: {e}")
+
+
+def _get_fingerprint_file() -> str:
+    return os.path.join(get_config_path(), "completion", "fingerprint")
+
+
+def _get_fingerprint(index: Optional[CommandsIndex]) -> str:
+    data = [index.sha, index.get_commands()] if index is not None else None
+    return hashlib.sha1(json.dumps(data, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _write_file(fn: str, content: str) -> None:
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    tmp = f"{fn}.{os.getpid()}.tmp"
+    with open(tmp, "w") as fp:
+        fp.write(content)
+    os.replace(tmp, fn)
+
+
+if __name__ == "__main__":
+    main()
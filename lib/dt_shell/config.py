@@ -1,8 +1,6 @@
 import os.path
-from dataclasses import dataclass
-from typing import Dict, Optional
-
-import yaml
+from dataclasses import dataclass, replace
+from typing import Dict, Optional, Tuple
 
 from . import dtslogger
 from .constants import DTShellConstants
@@ -76,6 +74,9 @@ CONFIG_DOCKER_PASSWORD = DTShellConstants.CONFIG_DOCKER_PASSWORD
 CONFIG_DUCKIETOWN_VERSION = DTShellConstants.CONFIG_DUCKIETOWN_VERSION
 CONFIG_DOCKER_CREDENTIALS = DTShellConstants.CONFIG_DOCKER_CREDENTIALS
 
+# the configs read (or written) by this process, by file name, with the (mtime, size, inode) of the file
+_shell_configs: Dict[str, Tuple[Tuple[int, int, int], ShellConfig]] = {}
+
 
 def write_shell_config_to_file(shell_config: ShellConfig, filename: str) -> None:
     data = {
@@ -88,13 +89,55 @@ def write_shell_config_to_file(shell_config: ShellConfig, filename: str) -> None
     dn = os.path.dirname(filename)
     if not os.path.exists(dn):
         os.makedirs(dn)
-    with open(filename, "w") as f:
-        s = yaml.dump(data)
+    import yaml
+
+    # readers (also in other processes) never see a partially written file
+    tmp = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        s = yaml.dump(data, Dumper=getattr(yaml, "CSafeDumper", yaml.SafeDumper))
         f.write(s)
+    os.replace(tmp, filename)
+    # what we just wrote does not need to be parsed again
+    _cache_shell_config(filename, shell_config)
 
 
 def read_shell_config_from_file(fn: str) -> ShellConfig:
-    """Raises InvalidConfig or ConfigNotPresent"""
+    """Raises InvalidConfig or ConfigNotPresent
+
+    The file is only parsed again when it changed since the last time it was read (or written).
+    """
+    try:
+        key = _get_file_key(fn)
+    except OSError:
+        raise ConfigNotPresent(fn)
+    cached = _shell_configs.get(fn)
+    if cached is not None and cached[0] == key:
+        return _copy_shell_config(cached[1])
+    shell_config = _parse_shell_config_file(fn)
+    _shell_configs[fn] = key, shell_config
+    return _copy_shell_config(shell_config)
+
+
+def _get_file_key(fn: str) -> Tuple[int, int, int]:
+    st = os.stat(fn)
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def _cache_shell_config(fn: str, shell_config: ShellConfig) -> None:
+    try:
+        _shell_configs[fn] = _get_file_key(fn), _copy_shell_config(shell_config)
+    except OSError:
+        _shell_configs.pop(fn, None)
+
+
+def _copy_shell_config(shell_config: ShellConfig) -> ShellConfig:
+    # the callers can modify what they get without affecting the cache
+    credentials = shell_config.docker_credentials
+    credentials = {k: dict(v) if isinstance(v, dict) else v for k, v in credentials.items()}
+    return replace(shell_config, docker_credentials=credentials)
+
+
+def _parse_shell_config_file(fn: str) -> ShellConfig:
     dtslogger.debug(f"reading config {fn}")
 
     if not os.path.exists(fn):
@@ -103,8 +146,15 @@ def read_shell_config_from_file(fn: str) -> ShellConfig:
     with open(fn, "r") as fp:
         data = fp.read()
 
+    import yaml
+
     try:
-        d = yaml.load(data, Loader=yaml.Loader)
+        try:
+            # the C implementation (libyaml) is much faster, if available
+            d = yaml.load(data, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+        except yaml.constructor.ConstructorError:
+            # Python-specific tags
+            d = yaml.load(data, Loader=yaml.Loader)
     except BaseException as e:
         msg = f"Cannot read config file {fn}"
         raise InvalidConfig(msg) from e
@@ -1,14 +1,19 @@
 # -*- coding: utf-8 -*-
 from typing import Optional
 
-import termcolor
-
 from . import __version__
 
 
 class DTShellConstants:
     ROOT = "~/.dt-shell/"
     ENV_COMMANDS = "DTSHELL_COMMANDS"
+    ENV_SERVER_SOCKET = "DTSHELL_SERVER_SOCKET"
+    ENV_SERVER_FD = "DTSHELL_SERVER_FD"
+    ENV_WATCH = "DTSHELL_WATCH"
+    ENV_PYCACHE_PREFIX = "DTSHELL_PYCACHE_PREFIX"
+    ENV_NETWORK_DEADLINE = "DTSHELL_NETWORK_DEADLINE"
+    ENV_GIT_JOBS = "DTSHELL_GIT_JOBS"
+    ENV_CLONE = "DTSHELL_CLONE"
 
     DT1_TOKEN_CONFIG_KEY = "token_dt1"
     CONFIG_DOCKER_USERNAME = "docker_username"
@@ -23,10 +28,21 @@ DEBUG = False
 
 CHECK_CMDS_UPDATE_MINS = 5
 
+# seconds the startup checks can spend on the network (all together)
+NETWORK_DEADLINE_SECS = 3.0
+
+# attempts at fetching the commands, the wait between them doubles every time (starting from this)
+UPDATE_TRIES = 3
+UPDATE_RETRY_SECS = 1.0
+# submodules fetched in parallel
+GIT_JOBS = 4
+
 DNAME = "Duckietown Shell"
 
 
 def INTRO(extra: Optional[str] = None) -> str:
+    import termcolor
+
     return """
 
 Welcome to the interactive {Duckietown} ({version}).
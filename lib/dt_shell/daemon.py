@@ -0,0 +1,286 @@
+import array
+import json
+import os
+import signal
+import socket
+import sys
+from typing import Callable, Dict, List, Mapping, Optional, Set, Tuple
+
+from .constants import DTShellConstants
+
+__all__ = ["get_server_socket_path", "run_in_server", "serve"]
+
+# number of times the client reconnects to a server that is restarting
+MAX_CLIENT_RETRIES = 3
+
+# file descriptors forwarded from the client to the server (stdin, stdout, stderr)
+FORWARDED_FDS = [0, 1, 2]
+
+# env. variables that shape the shell (besides the ones of the shell, `DTSHELL_*`), the server only runs
+# the commands of clients that agree with it on all of them
+SHELL_ENV = ["HOME"]
+# env. variables of the shell that are paths, relative to the working directory
+SHELL_ENV_PATHS = [DTShellConstants.ENV_COMMANDS, DTShellConstants.ENV_PYCACHE_PREFIX]
+# env. variables of the shell that do not concern the commands
+SERVER_ENV = [DTShellConstants.ENV_SERVER_SOCKET, DTShellConstants.ENV_SERVER_FD]
+
+
+def get_server_socket_path() -> str:
+    V = DTShellConstants.ENV_SERVER_SOCKET
+    if V in os.environ:
+        return os.environ[V]
+    return os.path.join(os.path.expanduser(DTShellConstants.ROOT), "dts.sock")
+
+
+# ---------------------------------------------------------------------------------------------------------
+# client
+
+
+def run_in_server(arguments: List[str]) -> Optional[int]:
+    """Runs a command in the shell server, if one is running.
+
+    The client's stdin/stdout/stderr are handed over to the server, so the output of the command
+    (and of the processes it spawns) goes straight to the caller's terminal.
+
+    Returns the exit code of the command, or None if no server could run it.
+    """
+    if not hasattr(socket, "AF_UNIX") or not hasattr(socket.socket, "sendmsg"):
+        return None
+    socket_path = get_server_socket_path()
+    if not os.path.exists(socket_path):
+        return None
+    request = {"arguments": arguments, "cwd": os.getcwd(), "env": dict(os.environ)}
+    for _ in range(MAX_CLIENT_RETRIES):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(socket_path)
+            sock.sendmsg(
+                [(json.dumps(request) + "\n").encode("utf-8")],
+                [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", FORWARDED_FDS))],
+            )
+            restart, exit_code = _wait_for_command(sock)
+        except OSError:
+            return None
+        finally:
+            sock.close()
+        if not restart:
+            return exit_code
+    return None
+
+
+def _wait_for_command(sock: socket.socket) -> Tuple[bool, Optional[int]]:
+    """Returns whether the server is restarting and the exit code of the command."""
+    pid = None
+    fp = sock.makefile("r")
+    while True:
+        try:
+            line = fp.readline()
+        except KeyboardInterrupt:
+            # the terminal sends SIGINT to us, forward it to the process running the command
+            if pid is None:
+                raise
+            os.kill(pid, signal.SIGINT)
+            continue
+        if not line:
+            # the server went away, run the command locally if it did not start yet
+            return False, (None if pid is None else 1)
+        message = json.loads(line)
+        if message.get("restart", False):
+            return True, None
+        if "declined" in message:
+            # the server runs a different shell (e.g., other commands), run the command locally
+            return False, None
+        if "pid" in message:
+            pid = message["pid"]
+        if "exit_code" in message:
+            return False, message["exit_code"]
+
+
+def get_shell_env(env: Mapping[str, str], cwd: str) -> Dict[str, str]:
+    """Returns the env. variables in `env` that shape the shell, with the paths made absolute."""
+    shell_env = {}
+    for name, value in env.items():
+        if name in SERVER_ENV or not (name.startswith("DTSHELL_") or name in SHELL_ENV):
+            continue
+        if name in SHELL_ENV_PATHS and value:
+            value = os.path.normpath(os.path.join(cwd, os.path.expanduser(value)))
+        shell_env[name] = value
+    return shell_env
+
+
+# ---------------------------------------------------------------------------------------------------------
+# server
+
+# processes forked to run the commands, reaped when they exit
+_children: Set[int] = set()
+
+
+def serve(shell, run_command: Callable[[object, List[str]], int], fingerprint: Callable[[], object]) -> None:
+    """Keeps an initialized shell resident and runs the commands sent by `dts` clients.
+
+    Each command runs in a process forked from the server, so it starts with every command
+    module already imported and cannot alter the state of the server.
+    The server restarts itself as soon as `fingerprint()` changes (e.g., config or commands changed).
+    """
+    from . import dtslogger
+
+    socket_path = get_server_socket_path()
+    server = _get_server_socket(socket_path)
+    # only the forked children are reaped, the exit code of the other processes (e.g., git) is still needed
+    signal.signal(signal.SIGCHLD, _reap_children)
+    # the commands of clients with a different environment would not run in the same shell
+    shell_env = get_shell_env(os.environ, os.getcwd())
+    # clean up the socket when we are terminated
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    current = fingerprint()
+    dtslogger.info(f"Shell server listening on '{socket_path}'. Press Ctrl-C to stop it.")
+    try:
+        while True:
+            conn, _ = server.accept()
+            try:
+                request, fds = _receive_request(conn)
+            except (OSError, ValueError) as e:
+                dtslogger.warning(f"Ignoring invalid request: {e}")
+                conn.close()
+                continue
+            if fingerprint() != current:
+                dtslogger.info("Configuration or commands changed, restarting the shell server...")
+                _send(conn, {"restart": True})
+                conn.close()
+                for fd in fds:
+                    os.close(fd)
+                _restart(server)
+            declined = _check_shell_env(request, shell_env)
+            if declined is not None:
+                dtslogger.debug(f"Declining the request of a client: {declined}")
+                _send(conn, {"declined": declined})
+                conn.close()
+                for fd in fds:
+                    os.close(fd)
+                continue
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+            if pid == 0:
+                server.close()
+                _run_child(shell, run_command, conn, request, fds)
+            _children.add(pid)
+            conn.close()
+            for fd in fds:
+                os.close(fd)
+    except KeyboardInterrupt:
+        dtslogger.info("Shell server stopped.")
+    finally:
+        server.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def _get_server_socket(socket_path: str) -> socket.socket:
+    V = DTShellConstants.ENV_SERVER_FD
+    if V in os.environ:
+        # we were restarted, keep using the same socket so that clients can wait for us
+        fd = int(os.environ.pop(V))
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM, fileno=fd)
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+        except OSError:
+            # stale socket left by a server that died
+            os.remove(socket_path)
+        else:
+            from .exceptions import UserError
+
+            raise UserError(f"Another shell server is already listening on '{socket_path}'.")
+        finally:
+            probe.close()
+    os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # the socket must never be accessible to other users, not even between bind() and chmod()
+    umask = os.umask(0o077)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(umask)
+    os.chmod(socket_path, 0o600)
+    server.listen(16)
+    return server
+
+
+def _check_shell_env(request: dict, shell_env: Dict[str, str]) -> Optional[str]:
+    """Returns why the server cannot run the command of the client, None if it can."""
+    client_env = get_shell_env(request.get("env", {}), request.get("cwd", "/"))
+    different = sorted(
+        name for name in set(client_env) | set(shell_env) if client_env.get(name) != shell_env.get(name)
+    )
+    if different:
+        return "different env. variables: " + ", ".join(different)
+    return None
+
+
+def _reap_children(*_) -> None:
+    for pid in list(_children):
+        try:
+            done, _status = os.waitpid(pid, os.WNOHANG)
+        except ChildProcessError:
+            done = pid
+        if done:
+            _children.discard(pid)
+
+
+def _restart(server: socket.socket) -> None:
+    # an ignored SIGCHLD would survive execv(), making subprocesses look successful
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    os.set_inheritable(server.fileno(), True)
+    os.environ[DTShellConstants.ENV_SERVER_FD] = str(server.fileno())
+    os.execv(sys.executable, [sys.executable] + sys.argv)
+
+
+def _receive_request(conn: socket.socket) -> Tuple[dict, List[int]]:
+    fds = array.array("i")
+    data, ancdata, _, _ = conn.recvmsg(65536, socket.CMSG_LEN(len(FORWARDED_FDS) * fds.itemsize))
+    for level, kind, payload in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(payload[: len(payload) - (len(payload) % fds.itemsize)])
+    fds = list(fds)
+    while not data.endswith(b"\n"):
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    if len(fds) != len(FORWARDED_FDS):
+        for fd in fds:
+            os.close(fd)
+        raise ValueError("Expected %d file descriptors, got %d." % (len(FORWARDED_FDS), len(fds)))
+    return json.loads(data.decode("utf-8")), fds
+
+
+def _run_child(shell, run_command, conn: socket.socket, request: dict, fds: List[int]) -> None:
+    exit_code = 1
+    try:
+        signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        # detach from the server's terminal, signals come from the client
+        os.setsid()
+        # take over the client's terminal, working directory and environment
+        for fd, target in zip(fds, FORWARDED_FDS):
+            os.dup2(fd, target)
+            os.close(fd)
+        os.chdir(request["cwd"])
+        os.environ.clear()
+        os.environ.update(request["env"])
+        sys.argv = [sys.argv[0]] + request["arguments"]
+        _send(conn, {"pid": os.getpid()})
+        exit_code = run_command(shell, request["arguments"])
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        try:
+            _send(conn, {"exit_code": exit_code})
+        finally:
+            os._exit(exit_code)
+
+
+def _send(conn: socket.socket, message: dict) -> None:
+    conn.sendall((json.dumps(message) + "\n").encode("utf-8"))
@@ -4,8 +4,6 @@ import subprocess
 import sys
 from typing import List, Optional, Tuple
 
-from whichcraft import which
-
 from .config import read_shell_config
 from .exceptions import InvalidEnvironment, UserError
 
@@ -78,6 +76,8 @@ def on_linux() -> bool:
 
 
 def check_executable_exists(cmdname: str) -> None:
+    from whichcraft import which
+
     p = which(cmdname)
     if p is None:
         msg = 'Could not find executable "%s".' % cmdname
@@ -0,0 +1,108 @@
+import os
+import re
+from typing import Optional
+
+from . import dtslogger
+
+__all__ = ["find_git_dir", "read_ref", "get_head_sha"]
+
+SHA_PATTERN = re.compile(r"^([0-9a-f]{40}|[0-9a-f]{64})$")
+
+# refs that belong to a worktree even when the refs are shared with the main repository
+PER_WORKTREE_REFS = ("refs/bisect/", "refs/worktree/", "refs/rewritten/")
+
+# symbolic refs pointing to symbolic refs are followed up to this depth (same as git)
+MAX_SYMREF_DEPTH = 5
+
+
+def find_git_dir(repo_path: str) -> Optional[str]:
+    """Returns the git directory of the repository (or worktree, or submodule) in `repo_path`.
+
+    Worktrees and submodules have a `.git` file pointing to their git directory instead of a `.git` dir.
+    """
+    dot_git = os.path.join(repo_path, ".git")
+    if os.path.isdir(dot_git):
+        return dot_git
+    try:
+        with open(dot_git, "r") as fp:
+            content = fp.read().strip()
+    except OSError:
+        return None
+    if not content.startswith("gitdir:"):
+        return None
+    git_dir = content[len("gitdir:") :].strip()
+    return os.path.normpath(os.path.join(repo_path, git_dir))
+
+
+def read_ref(git_dir: str, ref: str) -> Optional[str]:
+    """Resolves a ref (e.g., HEAD, refs/heads/master) to a SHA without spawning git.
+
+    Returns None if the ref cannot be resolved by looking at the files (e.g., a reftable repository).
+    """
+    common_dir = _get_common_dir(git_dir)
+    for _ in range(MAX_SYMREF_DEPTH):
+        value = _read_loose_ref(git_dir, common_dir, ref)
+        if value is None:
+            value = _read_packed_ref(common_dir, ref)
+        if value is None:
+            return None
+        if not value.startswith("ref:"):
+            return value if SHA_PATTERN.match(value) else None
+        ref = value[len("ref:") :].strip()
+    return None
+
+
+def get_head_sha(repo_path: str) -> Optional[str]:
+    """Returns the SHA of HEAD of the repository in `repo_path`, None if it is not a git repository.
+
+    The SHA is read from the files of the repository, git is only called for unusual layouts.
+    """
+    git_dir = find_git_dir(repo_path)
+    if git_dir is None:
+        return None
+    sha = read_ref(git_dir, "HEAD")
+    if sha is not None:
+        return sha
+    dtslogger.debug(f"Cannot resolve HEAD of '{repo_path}' by reading the files, asking git.")
+    from .utils import run_cmd
+
+    out = run_cmd(["git", "-C", repo_path, "rev-parse", "HEAD"])
+    return next(filter(len, (out or "").split("\n")), None)
+
+
+def _get_common_dir(git_dir: str) -> str:
+    # worktrees share the refs of the main repository, found through `commondir`
+    try:
+        with open(os.path.join(git_dir, "commondir"), "r") as fp:
+            return os.path.normpath(os.path.join(git_dir, fp.read().strip()))
+    except OSError:
+        return git_dir
+
+
+def _read_loose_ref(git_dir: str, common_dir: str, ref: str) -> Optional[str]:
+    if ref == "HEAD" or not ref.startswith("refs/") or ref.startswith(PER_WORKTREE_REFS):
+        locations = [git_dir]
+    else:
+        locations = [common_dir]
+    for location in locations:
+        try:
+            with open(os.path.join(location, ref), "r") as fp:
+                return fp.read().strip()
+        except OSError:
+            pass
+    return None
+
+
+def _read_packed_ref(common_dir: str, ref: str) -> Optional[str]:
+    try:
+        with open(os.path.join(common_dir, "packed-refs"), "r") as fp:
+            for line in fp:
+                # skip the header and the peeled tags
+                if line.startswith(("#", "^")):
+                    continue
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    except OSError:
+        pass
+    return None
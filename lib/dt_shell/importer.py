@@ -0,0 +1,75 @@
+import sys
+from importlib.machinery import PathFinder
+from typing import Dict, List, Optional
+
+__all__ = ["CommandsFinder", "install_commands_finder"]
+
+
+class CommandsFinder:
+    """Meta path finder for the top-level modules of the commands tree (and of its `lib` dir).
+
+    This replaces adding the commands tree to `sys.path`, which made every import of the process
+    (stdlib and site-packages included) probe the commands directories first. Here, a top-level
+    module is looked up in the index of the commands and only then handed to the default path-based
+    finder, restricted to the directory containing it. Sub-modules are found through the `__path__`
+    of their parent package, as usual.
+    """
+
+    def __init__(self, modules: Dict[str, str]):
+        # top-level module name -> directory containing it
+        self.modules = modules
+
+    def find_spec(self, fullname, path, target=None):
+        if path is not None:
+            return None
+        location = self.modules.get(fullname)
+        if location is None:
+            return None
+        spec = PathFinder.find_spec(fullname, [location], target)
+        if spec is None or spec.loader is not None:
+            return spec
+        # a directory without `__init__.py`: as if the commands were first in `sys.path`, a regular module
+        # found anywhere takes precedence, otherwise the portions of the namespace package are merged
+        return PathFinder.find_spec(fullname, [location] + sys.path, target)
+
+    def find_distributions(self, context=None):
+        # keep the metadata of the libraries in `lib` discoverable (e.g., `importlib.metadata.version`)
+        try:
+            from importlib.metadata import DistributionFinder, MetadataPathFinder
+        except ImportError:
+            return iter([])
+        if context is None:
+            context = DistributionFinder.Context()
+        if "path" in vars(context):
+            # the caller asked for specific locations
+            return iter([])
+        locations = _unique(self.modules.values())
+        context = DistributionFinder.Context(name=context.name, path=locations)
+        return MetadataPathFinder.find_distributions(context)
+
+    def invalidate_caches(self):
+        pass
+
+
+def _unique(values) -> List[str]:
+    return list(dict.fromkeys(values))
+
+
+_finder: Optional[CommandsFinder] = None
+
+
+def install_commands_finder(modules: Dict[str, str]) -> CommandsFinder:
+    """Makes the given top-level modules importable, replacing the ones installed before (if any)."""
+    global _finder
+    if _finder is None:
+        _finder = CommandsFinder(modules)
+        # right before the default path-based finder, the commands cannot shadow built-in modules
+        position = len(sys.meta_path)
+        for i, finder in enumerate(sys.meta_path):
+            if finder is PathFinder:
+                position = i
+                break
+        sys.meta_path.insert(position, _finder)
+    else:
+        _finder.modules = modules
+    return _finder
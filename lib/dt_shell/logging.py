@@ -1,7 +1,5 @@
 from typing import Optional, Sequence
 
-import termcolor
-
 from .utils import dark_yellow
 
 __all__ = ["dts_print"]
@@ -11,6 +9,8 @@ def dts_print(msg: str, color: Optional[str] = None, attrs: Sequence[str] = ())
     """
     Prints a message to the user.
     """
+    import termcolor
+
     msg = msg.strip()  # remove space
     print("")  # always separate
     lines = msg.split("\n")
@@ -3,16 +3,22 @@ import logging
 import os
 import re
 import sys
-from typing import Dict, Union
+import time
+from typing import Callable, Dict, List, Union
 
 import dt_shell
-import termcolor
-import yaml
 
 from . import __version__, dtslogger
 from .cli import DTShell, get_local_commands_info
 from .cli_options import get_cli_options
-from .config import get_shell_config_default, read_shell_config, write_shell_config
+from .commands_index import get_commands_index
+from .config import (
+    get_config_path,
+    get_shell_config_default,
+    get_shell_config_file,
+    read_shell_config,
+    write_shell_config,
+)
 from .constants import ALLOWED_BRANCHES
 from .env_checks import abort_if_running_with_sudo
 from .exceptions import (
@@ -23,8 +29,9 @@ from .exceptions import (
     UserError,
 )
 from .logging import dts_print
-from .utils import format_exception, replace_spaces
+from .utils import format_exception
 from .package_version_check import _get_installed_distributions
+from .profiling import enable_startup_profiler, get_startup_profiler, profile_phase
 
 
 class OtherVersions:
@@ -32,13 +39,26 @@ class OtherVersions:
 
 
 def cli_main() -> None:
+    # one-shot commands run in the shell server, if there is one
+    arguments = sys.argv[1:]
+    if arguments and not arguments[0].startswith("-"):
+        from .daemon import run_in_server
+
+        exit_code = run_in_server(arguments)
+        if exit_code is not None:
+            sys.exit(exit_code)
+
     from .col_logging import setup_logging_color
 
     setup_logging_color()
+    run_guarded(cli_main_)
 
+
+def run_guarded(f: Callable[[], None]) -> None:
+    """Runs `f`, reports errors to the user and exits with the corresponding exit code."""
     known_exceptions = (InvalidEnvironment, CommandsLoadingException)
     try:
-        cli_main_()
+        f()
     except UserError as e:
 
         msg = str(e)
@@ -94,6 +114,8 @@ def print_version_info() -> None:
     except ImportError:
         dtslogger.warning('Please update "pip" to have better debug info.')
 
+    import yaml
+
     versions = yaml.dump(v, default_flow_style=False)
     # Please = termcolor.colored('Please', 'red', attrs=['bold'])
     fn = "~/shell-debug-info.txt"
@@ -106,6 +128,68 @@ To report a bug, please also include the contents of {fn}
     dts_print(msg, "red")
 
 
+def print_header() -> None:
+    import termcolor
+
+    print(
+        "{name} (v{version})".format(
+            name=termcolor.colored("Duckietown Shell", "yellow", attrs=["bold"]), version=__version__
+        )
+    )
+
+
+def get_shell_fingerprint(shell: DTShell) -> Callable[[], object]:
+    """Returns a function whose value changes when the shell would need to be initialized again."""
+    config_file = get_shell_config_file()
+    index = get_commands_index(shell.commands_path)
+    commands_link = shell.local_commands_info.commands_path
+
+    def fingerprint():
+        try:
+            st = os.stat(config_file)
+            config = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            config = None
+        # an update activates a different tree of commands
+        return config, index.is_valid(), os.path.realpath(commands_link)
+
+    return fingerprint
+
+
+def run_in_forked_server(shell: DTShell, arguments: List[str]) -> int:
+    """Runs a one-shot command in a process forked from the shell server."""
+    print_header()
+    dtslogger.info(f"Commands version: {shell.get_commands_version()}")
+    try:
+        run_guarded(lambda: shell.onecmd_argv(arguments))
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        return e.code if isinstance(e.code, int) else 1
+    finally:
+        # the child does not run the exit handlers
+        shell.startup_checks.report()
+    return 0
+
+
+def report_startup_profile(shell: DTShell) -> None:
+    profiler = get_startup_profiler()
+    profiler.stop_tracing_imports()
+    profiler.info.update(
+        {
+            "duckietown-shell": __version__,
+            "python": sys.version,
+            "commands-version": shell.get_commands_version(),
+            "commands-sha": get_commands_index(shell.commands_path).sha,
+            "arguments": sys.argv[1:],
+        }
+    )
+    fn = os.path.join(get_config_path(), "profiles", "startup-%s.json" % time.strftime("%Y%m%d-%H%M%S"))
+    profiler.save(fn)
+    print(profiler.report())
+    dts_print(f"Startup profile saved to {fn}")
+
+
 def cli_main_() -> None:
     abort_if_running_with_sudo()
 
@@ -116,18 +200,19 @@ def cli_main_() -> None:
     # TODO: register handler for Ctrl-C
     cli_arguments = sys.argv[1:]
     cli_options, arguments = get_cli_options(cli_arguments)
+    if cli_options.profile_startup:
+        enable_startup_profiler()
 
-    if not cli_options.quiet:
-        print("{name} (v{version})".format(
-            name=termcolor.colored("Duckietown Shell", "yellow", attrs=["bold"]), version=__version__)
-        )
+    if not cli_options.quiet and cli_options.completion is None:
+        print_header()
 
     # process options here
     if cli_options.debug:
         dtslogger.setLevel(logging.DEBUG)
 
     try:
-        shell_config = read_shell_config()
+        with profile_phase("read_shell_config"):
+            shell_config = read_shell_config()
     except ConfigInvalid as e:
         msg = "Cannot read the malformed config. Please delete the file."
         raise UserError(msg) from e
@@ -172,14 +257,33 @@ def cli_main_() -> None:
             commands_info.commands_path, shell_config.duckietown_version
         )
 
-    shell = DTShell(shell_config, commands_info)
+    with profile_phase("init_shell"):
+        shell = DTShell(shell_config, commands_info)
 
     # populate singleton
     dt_shell.shell = shell
 
-    if arguments:
-        arguments = map(replace_spaces, arguments)
-        cmdline = " ".join(arguments)
-        shell.onecmd(cmdline)
+    if cli_options.completion is not None:
+        from .completion_scripts import get_completion_script_file, write_completion_scripts
+
+        write_completion_scripts(shell.commands_path)
+        fn = get_completion_script_file(cli_options.completion)
+        dts_print(f"Completion script written to {fn}, add this line to your shell's rc file:")
+        print(f"\n    source {fn}\n")
+    elif cli_options.server:
+        from .daemon import serve
+
+        shell.preload_commands()
+        serve(shell, run_in_forked_server, get_shell_fingerprint(shell))
+    elif arguments:
+        with profile_phase("onecmd"):
+            shell.onecmd_argv(arguments)
+    elif cli_options.profile_startup:
+        # nothing to run, profile the import of all the installed commands instead
+        with profile_phase("preload_commands"):
+            shell.preload_commands()
     else:
         shell.cmdloop()
+
+    if cli_options.profile_startup:
+        report_startup_profile(shell)
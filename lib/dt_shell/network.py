@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from . import dtslogger
+from .config import get_config_path
+from .constants import DTShellConstants, NETWORK_DEADLINE_SECS
+from .exceptions import URLException
+
+__all__ = ["get_url", "get_url_cached", "get_network_deadline", "get_remaining_time", "run_probes"]
+
+
+def get_url(url, timeout=3, deadline: Optional[float] = None) -> str:
+    """Downloads `url`, giving up after `timeout` seconds or when the (monotonic) `deadline` is reached."""
+    _, _, body = _request(url, {}, timeout, deadline)
+    return body
+
+
+def get_url_cached(url: str, extract: Callable[[str], object], timeout=3, deadline: Optional[float] = None):
+    """Returns `extract(body)` of the resource at `url`.
+
+    The extracted value is cached on disk with the validators of the response (ETag, Last-Modified)
+    and the following requests are conditional: if the resource did not change (304), it is neither
+    downloaded nor parsed again. The value must be JSON-serializable.
+    """
+    cache_file = _get_http_cache_file(url)
+    cached = _read_http_cache(cache_file, url)
+    headers = {}
+    if cached is not None:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+    status, res_headers, body = _request(url, headers, timeout, deadline)
+    if status == 304:
+        if cached is None:
+            raise URLException(f"Unexpected response 304 for {url}.")
+        dtslogger.debug(f"{url} did not change, using the cached value.")
+        return cached["value"]
+    value = extract(body)
+    entry = {"url": url, "etag": res_headers.get("etag"), "last_modified": res_headers.get("last-modified")}
+    if entry["etag"] or entry["last_modified"]:
+        entry["value"] = value
+        _write_http_cache(cache_file, entry)
+    return value
+
+
+def _request(url: str, headers: Dict[str, str], timeout: float, deadline: Optional[float]):
+    """Returns the status (200 or 304), the headers (lower-case names) and the body of the response."""
+    from six.moves import urllib
+
+    timeout = get_remaining_time(deadline, timeout)
+    if timeout <= 0:
+        raise URLException(f"No time left to get {url}.")
+    try:
+        req = urllib.request.Request(url, headers=headers)
+        try:
+            res = urllib.request.urlopen(req, timeout=timeout)
+        except urllib.error.HTTPError as e:
+            # urllib treats anything but 2xx as an error
+            if e.code == 304:
+                return 304, _lower_keys(e.headers.items()), None
+            raise URLException(str(e))
+        content = res.read()
+        if res.getcode() != 200:
+            raise URLException(str(res))
+        return 200, _lower_keys(res.headers.items()), content.decode("utf-8")
+    except urllib.error.URLError:
+        dtslogger.debug("Falling back to using curl because urllib failed.")
+        return _request_with_curl(url, headers, deadline)
+
+
+def _request_with_curl(url: str, headers: Dict[str, str], deadline: Optional[float]):
+    from whichcraft import which
+
+    if which("curl") is None:
+        msg = "curl not available"
+        raise URLException(msg)
+    curl_timeout = get_remaining_time(deadline, 2)
+    if curl_timeout <= 0:
+        raise URLException(f"No time left to get {url}.")
+    with tempfile.TemporaryDirectory() as tmp:
+        headers_file = os.path.join(tmp, "headers")
+        cmd = ["curl", url, "-s", "-m", "%.1f" % curl_timeout, "-D", headers_file, "-w", "%{http_code}"]
+        for name, value in headers.items():
+            cmd += ["-H", f"{name}: {value}"]
+        cmd += ["-o", os.path.join(tmp, "body")]
+        try:
+            status = int(subprocess.check_output(cmd, stderr=subprocess.PIPE))
+        except (subprocess.CalledProcessError, ValueError) as e:
+            msg = "Could not call %s: %s" % (cmd, e)
+            raise URLException(msg)
+        if status not in [200, 304]:
+            raise URLException(f"Unexpected response {status} for {url}.")
+        with open(headers_file, "r") as fp:
+            # with redirects, the headers of the last response come last
+            lines = fp.read().replace("\r\n", "\n").strip().split("\n\n")[-1].splitlines()
+        res_headers = _lower_keys(line.split(":", 1) for line in lines if ":" in line)
+        if status == 304:
+            return 304, res_headers, None
+        with open(os.path.join(tmp, "body"), "rb") as fp:
+            return 200, res_headers, fp.read().decode("utf-8")
+
+
+def _lower_keys(items) -> Dict[str, str]:
+    return {k.strip().lower(): v.strip() for k, v in items}
+
+
+def _get_http_cache_file(url: str) -> str:
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    return os.path.join(get_config_path(), "http-cache", f"{key}.json")
+
+
+def _read_http_cache(cache_file: str, url: str) -> Optional[dict]:
+    try:
+        with open(cache_file, "r") as fp:
+            entry = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(entry, dict) or entry.get("url") != url or "value" not in entry:
+        return None
+    return entry
+
+
+def _write_http_cache(cache_file: str, entry: dict) -> None:
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as fp:
+            json.dump(entry, fp)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        dtslogger.debug(f"Could not write the HTTP cache '{cache_file}': {e}")
+
+
+def get_network_deadline() -> float:
+    """Returns the (monotonic) time by which the network probes of this run should be done.
+
+    The budget can be changed with the env. variable DTSHELL_NETWORK_DEADLINE (in seconds).
+    """
+    budget = NETWORK_DEADLINE_SECS
+    V = DTShellConstants.ENV_NETWORK_DEADLINE
+    if os.environ.get(V):
+        try:
+            budget = float(os.environ[V])
+        except ValueError:
+            dtslogger.warning(f"Ignoring invalid value {os.environ[V]!r} of the env. variable {V}.")
+    return time.monotonic() + budget
+
+
+def get_remaining_time(deadline: Optional[float], timeout: float) -> float:
+    """Returns the timeout to use for an operation that has to finish by `deadline` (if any)."""
+    if deadline is None:
+        return timeout
+    return min(timeout, deadline - time.monotonic())
+
+
+def run_probes(probes: Dict[str, Callable[[], object]], deadline: float) -> Dict[str, object]:
+    """Runs the probes concurrently and returns the results of the ones that succeeded by the deadline.
+
+    Probes that fail or miss the deadline are left out (i.e., their result is unknown), the latter
+    are abandoned in daemon threads.
+    """
+    results: Dict[str, object] = {}
+
+    def run(name: str, probe: Callable[[], object]) -> None:
+        try:
+            results[name] = probe()
+        except Exception as e:
+            dtslogger.debug(f"Network probe {name!r} failed: {e}")
+
+    threads = [
+        threading.Thread(target=run, args=(name, probe), name=f"dts-probe-{name}", daemon=True)
+        for name, probe in probes.items()
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(max(0.0, deadline - time.monotonic()))
+    finished = dict(results)
+    for name, thread in zip(probes, threads):
+        if thread.is_alive():
+            dtslogger.debug(f"Network probe {name!r} did not finish in time, ignoring it.")
+    return finished
@@ -0,0 +1,180 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterator, List, Optional
+
+__all__ = ["StartupProfiler", "enable_startup_profiler", "get_startup_profiler", "profile_phase"]
+
+
+@dataclass
+class PhaseRecord:
+    name: str
+    # seconds since the profiler was started
+    start: float
+    duration: float
+    # duration minus the duration of the nested phases
+    self_time: float
+    depth: int
+
+
+@dataclass
+class ImportRecord:
+    name: str
+    # same semantics of `python -X importtime`
+    self_time: float
+    cumulative: float
+    depth: int
+
+
+class StartupProfiler:
+    """Records the duration of the startup phases and of every module imported in the meantime."""
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = time.perf_counter() if started is None else started
+        self.phases: List[PhaseRecord] = []
+        self.imports: List[ImportRecord] = []
+        self.info: Dict[str, object] = {}
+        # stacks of [start, time spent in children] of the phases/imports in progress
+        self._phases_stack: List[List[float]] = []
+        self._imports_stack: List[List[float]] = []
+        self._finder = _ImportTimer(self)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        depth = len(self._phases_stack)
+        frame = [time.perf_counter(), 0.0]
+        self._phases_stack.append(frame)
+        try:
+            yield
+        finally:
+            self._phases_stack.pop()
+            duration = time.perf_counter() - frame[0]
+            if self._phases_stack:
+                self._phases_stack[-1][1] += duration
+            record = PhaseRecord(name, frame[0] - self.started, duration, duration - frame[1], depth)
+            self.phases.append(record)
+
+    def start_tracing_imports(self) -> None:
+        if self._finder not in sys.meta_path:
+            sys.meta_path.insert(0, self._finder)
+
+    def stop_tracing_imports(self) -> None:
+        if self._finder in sys.meta_path:
+            sys.meta_path.remove(self._finder)
+
+    def total(self) -> float:
+        return time.perf_counter() - self.started
+
+    def as_dict(self) -> dict:
+        return {
+            "info": self.info,
+            "total": self.total(),
+            "phases": [asdict(p) for p in sorted(self.phases, key=lambda p: p.start)],
+            "imports": [asdict(i) for i in self.imports],
+        }
+
+    def save(self, filename: str) -> None:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w") as fp:
+            json.dump(self.as_dict(), fp, indent=2)
+
+    def report(self, max_imports: int = 20) -> str:
+        lines = ["Startup profile (total: %s)" % _ms(self.total()), "", "  Phases:", ""]
+        lines.append("    %10s  %10s  %s" % ("total", "self", "phase"))
+        for p in sorted(self.phases, key=lambda p: p.duration, reverse=True):
+            lines.append("    %10s  %10s  %s%s" % (_ms(p.duration), _ms(p.self_time), "  " * p.depth, p.name))
+        lines += ["", "  Slowest imports:", ""]
+        lines.append("    %10s  %10s  %s" % ("cumulative", "self", "module"))
+        imports = sorted(self.imports, key=lambda i: i.cumulative, reverse=True)
+        for i in imports[:max_imports]:
+            lines.append(
+                "    %10s  %10s  %s%s" % (_ms(i.cumulative), _ms(i.self_time), "  " * i.depth, i.name)
+            )
+        return "\n".join(lines)
+
+
+def _ms(seconds: float) -> str:
+    return "%.1f ms" % (seconds * 1000)
+
+
+class _ImportTimer:
+    """Meta path finder that times the execution of the modules found by the other finders."""
+
+    def __init__(self, profiler: StartupProfiler):
+        self.profiler = profiler
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                spec.loader = _TimedLoader(spec.loader, self.profiler)
+            return spec
+        return None
+
+
+class _TimedLoader:
+    def __init__(self, loader, profiler: StartupProfiler):
+        self._loader = loader
+        self._profiler = profiler
+
+    def __getattr__(self, item):
+        return getattr(self._loader, item)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        # modules should only see the real loader
+        module.__loader__ = self._loader
+        if getattr(module, "__spec__", None) is not None:
+            module.__spec__.loader = self._loader
+        stack = self._profiler._imports_stack
+        depth = len(stack)
+        frame = [time.perf_counter(), 0.0]
+        stack.append(frame)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            stack.pop()
+            cumulative = time.perf_counter() - frame[0]
+            if stack:
+                stack[-1][1] += cumulative
+            record = ImportRecord(module.__name__, cumulative - frame[1], cumulative, depth)
+            self._profiler.imports.append(record)
+
+
+_profiler: Optional[StartupProfiler] = None
+
+
+def enable_startup_profiler() -> StartupProfiler:
+    global _profiler
+    if _profiler is None:
+        from . import _import_started, _import_finished
+
+        # the package itself was imported before we had a chance to start
+        _profiler = StartupProfiler(started=_import_started)
+        duration = _import_finished - _import_started
+        _profiler.phases.append(PhaseRecord("import dt_shell", 0.0, duration, duration, 0))
+        _profiler.start_tracing_imports()
+    return _profiler
+
+
+def get_startup_profiler() -> Optional[StartupProfiler]:
+    return _profiler
+
+
+@contextmanager
+def profile_phase(name: str) -> Iterator[None]:
+    """Times the enclosed block as a startup phase, does nothing unless the profiler is enabled."""
+    if _profiler is None:
+        yield
+        return
+    with _profiler.phase(name):
+        yield
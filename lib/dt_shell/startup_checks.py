@@ -0,0 +1,74 @@
+import atexit
+import threading
+from typing import List, Tuple
+
+from .config import RepoInfo
+from .network import get_network_deadline, run_probes
+
+__all__ = ["StartupChecks"]
+
+# seconds we are willing to wait at exit for the checks to finish, unfinished checks are repeated by the next run
+REPORT_WAIT_SECS = 0.5
+
+
+class StartupChecks:
+    """Checks for updates of the shell and of the commands in a background thread.
+
+    The commands run in the meantime, the results are shown when the process exits. Updates of the
+    commands found here are installed in the background (or by the next run of the shell, for commands
+    that are not double-buffered).
+    """
+
+    def __init__(self, commands_path: str, repo_info: RepoInfo, check_commands: bool):
+        self.commands_path = commands_path
+        self.repo_info = repo_info
+        self.check_commands = check_commands
+        # messages to show at exit, with their color
+        self.messages: List[Tuple[str, str]] = []
+        self._thread = threading.Thread(target=self._run, name="dts-update-checks", daemon=True)
+        self._reported = False
+
+    def start(self) -> None:
+        self._thread.start()
+        atexit.register(self.report)
+
+    def report(self) -> None:
+        """Shows the results of the checks (once), without waiting for slow checks."""
+        if self._reported:
+            return
+        self._reported = True
+        self._thread.join(timeout=REPORT_WAIT_SECS)
+        if not self.messages:
+            return
+        import termcolor
+
+        for msg, color in list(self.messages):
+            print(termcolor.colored(msg, color))
+
+    def _run(self) -> None:
+        from .background_update import start_background_update
+        from .commands_trees import is_double_buffered
+        from .update_utils import commands_need_update
+        from .version_check import get_outdated_message
+
+        # the checks run concurrently and share the same network budget
+        deadline = get_network_deadline()
+        probes = {"shell": lambda: get_outdated_message(deadline)}
+        if self.check_commands:
+            probes["commands"] = lambda: commands_need_update(self.commands_path, self.repo_info, deadline)
+        results = run_probes(probes, deadline)
+        if results.get("shell"):
+            self.messages.append((results["shell"], "yellow"))
+        if results.get("commands"):
+            if is_double_buffered(self.commands_path):
+                start_background_update(self.commands_path, self.repo_info)
+                msg = (
+                    "Updates of the Duckietown shell commands are available, "
+                    "they are being installed in the background."
+                )
+            else:
+                msg = (
+                    "Updates of the Duckietown shell commands are available, "
+                    "they will be installed the next time you run dts."
+                )
+            self.messages.append((msg, "yellow"))
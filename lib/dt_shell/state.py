@@ -0,0 +1,118 @@
+import copy
+import json
+import os
+import threading
+from typing import Callable, Optional, Tuple
+
+from . import dtslogger
+from .commands_trees import get_commands_link
+from .config import get_config_path
+from .utils import file_lock
+
+__all__ = ["get_state_file", "read_state", "update_state", "get_commands_state", "update_commands_state"]
+
+# bump this whenever the format of the state changes (and convert the old state in `_upgrade`)
+STATE_SCHEMA = 1
+
+# the state last read (or written) by this process, with the (mtime, size, inode) of the file and whether
+# the file can be written
+_cache: Optional[Tuple[Tuple[int, int, int], dict, bool]] = None
+_cache_lock = threading.Lock()
+# whether the user was told that the state is not updated (written by a newer shell)
+_warned = False
+
+
+def get_state_file() -> str:
+    return os.path.join(get_config_path(), "state.json")
+
+
+def read_state() -> dict:
+    """Returns the state of the shell (caches, update checks, ...), it must not be modified.
+
+    The file is only read again when it changed.
+    """
+    return _read_state()[0]
+
+
+def _read_state() -> Tuple[dict, bool]:
+    # also returns whether the state can be written back (it was not written by a newer shell)
+    global _cache
+    fn = get_state_file()
+    try:
+        st = os.stat(fn)
+    except OSError:
+        return _empty_state(), True
+    key = (st.st_mtime_ns, st.st_size, st.st_ino)
+    with _cache_lock:
+        if _cache is not None and _cache[0] == key:
+            return _cache[1], _cache[2]
+    try:
+        with open(fn, "r") as fp:
+            state, writable = _upgrade(json.load(fp))
+    except (OSError, ValueError) as e:
+        dtslogger.debug(f"Ignoring the invalid state in '{fn}': {e}")
+        state, writable = _empty_state(), True
+    with _cache_lock:
+        _cache = key, state, writable
+    return state, writable
+
+
+def update_state(f: Callable[[dict], None]) -> dict:
+    """Changes the state with `f`, which gets a copy of the current state and modifies it in place.
+
+    Concurrent updates (also by other processes) are applied one after the other. A state written by
+    a newer version of the shell is never overwritten, the changes are discarded instead.
+    """
+    global _cache, _warned
+    fn = get_state_file()
+    with file_lock(f"{fn}.lock"):
+        current, writable = _read_state()
+        state = copy.deepcopy(current)
+        f(state)
+        if not writable:
+            if not _warned:
+                dtslogger.warning(
+                    f"The state in '{fn}' was written by a newer version of the shell, not updating it."
+                )
+                _warned = True
+            return state
+        state["schema"] = STATE_SCHEMA
+        tmp = f"{fn}.{os.getpid()}.tmp"
+        with open(tmp, "w") as fp:
+            json.dump(state, fp, separators=(",", ":"))
+        os.replace(tmp, fn)
+        st = os.stat(fn)
+        with _cache_lock:
+            _cache = (st.st_mtime_ns, st.st_size, st.st_ino), state, True
+    return state
+
+
+def get_commands_state(commands_path: str) -> dict:
+    """Returns the state of the commands in `commands_path` (shared by the trees of a version)."""
+    return read_state()["commands"].get(get_commands_link(commands_path), {})
+
+
+def update_commands_state(commands_path: str, f: Callable[[dict], None]) -> None:
+    def update(state: dict) -> None:
+        f(state["commands"].setdefault(get_commands_link(commands_path), {}))
+
+    update_state(update)
+
+
+def _empty_state() -> dict:
+    return {"schema": STATE_SCHEMA, "commands": {}}
+
+
+def _upgrade(state: dict) -> Tuple[dict, bool]:
+    """Converts the state to the current schema, returns it and whether it can be written back."""
+    if not isinstance(state, dict):
+        return _empty_state(), True
+    schema = state.get("schema")
+    if isinstance(schema, int) and schema > STATE_SCHEMA:
+        # written by a newer version of the shell, it is not understood but it must not be lost
+        return _empty_state(), False
+    if schema != STATE_SCHEMA:
+        # there is no older schema to convert from (yet)
+        return _empty_state(), True
+    state.setdefault("commands", {})
+    return state, True
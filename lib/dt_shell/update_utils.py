@@ -1,110 +1,304 @@
+import hashlib
 import json
 import os
+import random
 import time
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional
 
-from . import dtslogger, version_check
-from . import version_check
-from .config import remoteurl_from_RepoInfo, RepoInfo
-from .constants import CHECK_CMDS_UPDATE_MINS
+from . import dtslogger
+from .bytecode import precompile_commands
+from .commands_index import get_commands_index, import_user_flags
+from .commands_trees import (
+    activate_tree,
+    checkout_tree,
+    collect_trees,
+    get_staging_tree,
+    init_objects_store,
+    is_double_buffered,
+)
+from .completion_scripts import update_completion_scripts
+from .config import get_config_path, remoteurl_from_RepoInfo, RepoInfo
+from .constants import CHECK_CMDS_UPDATE_MINS, DTShellConstants, GIT_JOBS, UPDATE_RETRY_SECS, UPDATE_TRIES
 from .exceptions import UserError
-from .utils import run_cmd
+from .git_refs import find_git_dir, get_head_sha, read_ref
+from .network import get_url_cached
+from .profiling import profile_phase
+from .state import get_commands_state, update_commands_state
+from .utils import file_lock, run_cmd
 
 
-def commands_need_update(commands_path: str, repo_info: RepoInfo) -> bool:
+def commands_need_update(commands_path: str, repo_info: RepoInfo, deadline: Optional[float] = None) -> bool:
+    # one process at a time checks (or updates), the others use what it records in the state
+    with file_lock(get_update_lock_file(commands_path), blocking=False) as locked:
+        if not locked:
+            dtslogger.debug("Another dts process is checking for updates of the commands.")
+            return False
+        return _commands_need_update(commands_path, repo_info, deadline)
+
+
+def _commands_need_update(commands_path: str, repo_info: RepoInfo, deadline: Optional[float] = None) -> bool:
     need_update = False
+    # an update found by a previous (background) check is still to be installed
+    if get_pending_commands_update(commands_path) is not None:
+        return True
     # Get the current repo info
-    commands_update_check_flag = os.path.join(commands_path, ".updates-check")
+    cached_check = get_commands_state(commands_path).get("update-check")
 
     # Check if it's time to check for an update
-    if os.path.exists(commands_update_check_flag) and os.path.isfile(commands_update_check_flag):
+    if cached_check is not None:
         now = time.time()
-        last_time_checked = os.path.getmtime(commands_update_check_flag)
+        last_time_checked = cached_check["checked"]
         use_cached_commands = now - last_time_checked < CHECK_CMDS_UPDATE_MINS * 60
-    else:  # Save the initial .update flag
-        local_sha: str = run_cmd(["git", "-C", commands_path, "rev-parse", "HEAD"])
-        # noinspection PyTypeChecker
-        local_sha = next(filter(len, local_sha.split("\n")))
+    else:  # Save the initial check
+        local_sha = get_head_sha(commands_path)
+        if local_sha is None:
+            raise RuntimeError(f"The commands in '{commands_path}' are not a git repository.")
         save_update_check_flag(commands_path, local_sha)
         return False
 
     # Check for an updated remote
     if not use_cached_commands:
-        # Get the local sha from file (ok if oos from manual pull)
-        with open(commands_update_check_flag, "r") as fp:
-            try:
-                cached_check = json.load(fp)
-            except ValueError:
-                return False
-            local_sha = cached_check["remote"]
+        # Get the local sha from the last check (ok if oos from manual pull)
+        local_sha = cached_check["remote"]
 
         # Get the remote sha from GitHub
-        dtslogger.info("Fetching remote SHA from github.com ...")
+        dtslogger.debug("Fetching remote SHA from github.com ...")
         remote_url: str = "https://api.github.com/repos/%s/%s/branches/%s" % (
             repo_info.username,
             repo_info.project,
             repo_info.branch,
         )
         try:
-            content = version_check.get_url(remote_url)
-            data = json.loads(content)
-            remote_sha = data["commit"]["sha"]
+            # conditional requests that get a 304 do not count against the rate limit of GitHub
+            remote_sha = get_url_cached(remote_url, _extract_commit_sha, deadline=deadline)
         except Exception as e:
-            dtslogger.error(str(e))
+            dtslogger.warning(f"Could not check for updates of the commands: {e}")
             return False
 
         # check if we need to update
         need_update = local_sha != remote_sha
-        # touch flag to reset update check time
-        touch_update_check_flag(commands_path)
+        # reset the update check time, and remember the update until it is installed
+        save_update_check_flag(commands_path, local_sha, available=remote_sha if need_update else None)
 
     return need_update
 
 
-def save_update_check_flag(commands_path: str, sha: str) -> None:
-    commands_update_check_flag = os.path.join(commands_path, ".updates-check")
-    with open(commands_update_check_flag, "w") as fp:
-        json.dump({"remote": sha}, fp)
+def _extract_commit_sha(content: str) -> str:
+    return json.loads(content)["commit"]["sha"]
+
+
+def save_update_check_flag(commands_path: str, sha: str, available: Optional[str] = None) -> None:
+    data = {"remote": sha, "checked": time.time()}
+    if available is not None:
+        data["available"] = available
+    update_commands_state(commands_path, lambda commands: commands.update({"update-check": data}))
+
+
+def get_pending_commands_update(commands_path: str) -> Optional[str]:
+    """Returns the SHA of an update of the commands that was found but not installed yet (if any)."""
+    return get_commands_state(commands_path).get("update-check", {}).get("available")
 
 
 def touch_update_check_flag(commands_path: str) -> None:
-    commands_update_check_flag = os.path.join(commands_path, ".updates-check")
-    with open(commands_update_check_flag, "a"):
-        os.utime(commands_update_check_flag, None)
+    def touch(commands: dict) -> None:
+        if "update-check" in commands:
+            commands["update-check"]["checked"] = time.time()
+
+    update_commands_state(commands_path, touch)
+
+
+def get_update_lock_file(commands_path: str) -> str:
+    key = hashlib.sha1(os.path.abspath(commands_path).encode("utf-8")).hexdigest()
+    return os.path.join(get_config_path(), "locks", f"{key}.lock")
+
+
+def get_git_jobs() -> int:
+    """Returns how many submodules git should fetch in parallel (env. variable DTSHELL_GIT_JOBS)."""
+    V = DTShellConstants.ENV_GIT_JOBS
+    try:
+        return max(1, int(os.environ[V]))
+    except KeyError:
+        return GIT_JOBS
+    except ValueError:
+        dtslogger.warning(f"Ignoring invalid value {os.environ[V]!r} of the env. variable {V}.")
+        return GIT_JOBS
+
+
+@contextmanager
+def _update_phase(name: str) -> Iterator[None]:
+    # the duration of each phase helps diagnosing slow updates
+    started = time.time()
+    try:
+        with profile_phase(f"update {name}"):
+            yield
+    finally:
+        dtslogger.debug(f"Commands update, {name}: {time.time() - started:.2f}s")
+
+
+def _retry(f: Callable[[], object], what: str) -> object:
+    """Calls `f` until it does not raise RuntimeError, backing off exponentially (with jitter)."""
+    for trial in range(UPDATE_TRIES):
+        try:
+            return f()
+        except RuntimeError as e:
+            if trial == UPDATE_TRIES - 1:
+                raise
+            wait = UPDATE_RETRY_SECS * 2**trial * random.uniform(0.5, 1.5)
+            dtslogger.debug(str(e))
+            dtslogger.warning(
+                f"An error occurred while {what}. Retrying in {wait:.1f} seconds "
+                f"(attempt {trial + 2}/{UPDATE_TRIES})."
+            )
+            time.sleep(wait)
+
+
+def deepen_commands(commands_path: str) -> bool:
+    """Downloads the full history of the commands if they were cloned shallow.
 
+    Returns whether the repository was shallow.
+    """
+    git_dir = find_git_dir(commands_path)
+    if git_dir is None or not os.path.exists(os.path.join(git_dir, "shallow")):
+        return False
+    dtslogger.info("Downloading the history of the Duckietown shell commands...")
+    run_cmd(["git", "-C", commands_path, "fetch", "--no-tags", "--unshallow", "origin"])
+    return True
+
+
+def update_cached_commands(commands_path: str, repo_info: RepoInfo, wait: bool = True) -> bool:
+    """Updates the commands if there are updates, returns whether it did.
 
-def update_cached_commands(commands_path: str, repo_info: RepoInfo) -> bool:
+    If another process is updating them already, it waits for it (if `wait`) and checks again.
+    """
     if not os.path.exists(commands_path) and os.path.isdir(commands_path):
         raise UserError(f"There is no existing commands directory in '{commands_path}'.")
+    lock_file = get_update_lock_file(commands_path)
+    with file_lock(lock_file, blocking=False) as locked:
+        if locked:
+            return _update_cached_commands(commands_path, repo_info)
+    if not wait:
+        dtslogger.debug("Another dts process is updating the commands.")
+        return False
+    dtslogger.info("Another dts process is updating the commands, waiting for it to finish...")
+    with file_lock(lock_file):
+        return _update_cached_commands(commands_path, repo_info)
+
 
+def _update_cached_commands(commands_path: str, repo_info: RepoInfo) -> bool:
     # Check for shell commands repo updates
     dtslogger.info("Checking for updates in the Duckietown shell commands repo...")
-    if commands_need_update(commands_path, repo_info):
+    if _commands_need_update(commands_path, repo_info):
         dtslogger.info("The Duckietown shell commands have available updates. Attempting to pull them.")
         dtslogger.debug(f"Updating Duckietown shell commands at '{commands_path}'...")
-        wait_on_retry_secs = 4
-        th = {2: "nd", 3: "rd", 4: "th"}
-        for trial in range(3):
-            try:
-                run_cmd(["git", "-C", commands_path, "pull", "--recurse-submodules", "origin", repo_info.branch])
-                dtslogger.debug(f"Updated Duckietown shell commands in '{commands_path}'.")
-                dtslogger.info(f"Duckietown shell commands successfully updated!")
-            except RuntimeError as e:
-                dtslogger.error(str(e))
-                dtslogger.warning(
-                    "An error occurred while pulling the updated commands. Retrying for "
-                    f"the {trial + 2}-{th[trial + 2]} in {wait_on_retry_secs} seconds."
-                )
-                time.sleep(wait_on_retry_secs)
+        started = time.time()
+        try:
+            if is_double_buffered(commands_path):
+                # the commands in use are left alone until the updated ones are ready
+                tree = stage_commands(commands_path, fetch_commands(commands_path, repo_info))
             else:
-                break
-        run_cmd(["git", "-C", commands_path, "submodule", "update"])
+                tree = commands_path
+                _pull_commands(commands_path, repo_info)
+        except RuntimeError as e:
+            dtslogger.error(f"Could not update the Duckietown shell commands: {e}")
+            return False
+        # compile the new commands now, so that their first run is as fast as the following ones
+        with _update_phase("compile"):
+            precompile_commands(tree)
+        if tree != commands_path:
+            with _update_phase("activate"):
+                activate_tree(commands_path, tree)
+            # the trees of older updates are removed once no process uses them anymore
+            with _update_phase("cleanup"):
+                _collect_trees(commands_path)
+        dtslogger.info(f"Duckietown shell commands successfully updated in {time.time() - started:.1f}s!")
 
         # Get HEAD sha after update and save
-        current_sha: str = run_cmd(["git", "-C", commands_path, "rev-parse", "HEAD"])
-        # noinspection PyTypeChecker
-        current_sha = next(filter(len, current_sha.split("\n")))
+        current_sha = get_head_sha(commands_path)
+        if current_sha is None:
+            raise RuntimeError(f"The commands in '{commands_path}' are not a git repository.")
         save_update_check_flag(commands_path, current_sha)
+        # the completion scripts (if any) are regenerated from the updated commands
+        update_completion_scripts(commands_path)
         return True  # Done updating
     else:
         dtslogger.info(f"Duckietown shell commands are up-to-date.")
         return False
+
+
+def _pull_commands(commands_path: str, repo_info: RepoInfo) -> None:
+    git = ["git", "-C", commands_path]
+    # only the tracked branch, the submodules are fetched (in parallel) by `submodule update`
+    with _update_phase("fetch"):
+        fetch = git + ["fetch", "--no-tags", "--recurse-submodules=no", "origin", repo_info.branch]
+        _retry(lambda: run_cmd(fetch), "fetching the updated commands")
+    with _update_phase("fast-forward"):
+        try:
+            run_cmd(git + ["merge", "--ff-only", "FETCH_HEAD"])
+        except RuntimeError:
+            # shallow clones might not have enough history to fast-forward
+            if not deepen_commands(commands_path):
+                raise
+            run_cmd(git + ["merge", "--ff-only", "FETCH_HEAD"])
+    with _update_phase("submodules"):
+        jobs = str(get_git_jobs())
+        submodules = git + ["submodule", "update", "--init", "--recursive", "--jobs", jobs]
+        _retry(lambda: run_cmd(submodules), "updating the submodules of the commands")
+
+
+def _collect_trees(commands_path: str) -> None:
+    try:
+        collect_trees(commands_path)
+    except (OSError, RuntimeError) as e:
+        # they will be removed by the next update
+        dtslogger.debug(f"Could not remove the unused trees of the commands: {e}")
+
+
+def fetch_commands(commands_path: str, repo_info: RepoInfo, args: Optional[List[str]] = None) -> str:
+    """Fetches the branch of the commands into the object store shared by all the versions.
+
+    Only the objects that are not in the store yet are downloaded. Returns the SHA of the branch.
+    """
+    branch = repo_info.branch
+    store = init_objects_store(commands_path, remoteurl_from_RepoInfo(repo_info), branch)
+    ref = f"refs/remotes/origin/{branch}"
+    refspec = f"+refs/heads/{branch}:{ref}"
+    fetch = ["git", "-C", store, "fetch", "--no-tags"] + (args or []) + ["origin", refspec]
+    with _update_phase("fetch"):
+        _retry(lambda: run_cmd(fetch), "fetching the commands")
+    sha = read_ref(store, ref)
+    if sha is None:
+        raise RuntimeError(f"Cannot find the branch {branch!r} of the commands in '{store}'.")
+    return sha
+
+
+def stage_commands(commands_path: str, sha: str, args: Optional[List[str]] = None) -> str:
+    """Checks out the commands at `sha` in a tree that no process is using, returns the tree."""
+    tree = get_staging_tree(commands_path, sha)
+    with _update_phase("checkout"):
+        checkout_tree(commands_path, tree, sha)
+    with _update_phase("submodules"):
+        jobs = str(get_git_jobs())
+        git = ["git", "-C", tree]
+        submodules = git + ["submodule", "update", "--init", "--recursive", "--force", "--jobs", jobs]
+        submodules += args or []
+        _retry(lambda: run_cmd(submodules), "updating the submodules of the commands")
+    # the flags of the commands installed by older versions of the shell are not in the new tree
+    import_user_flags(os.path.realpath(commands_path))
+    with _update_phase("verify"):
+        _verify_tree(tree, sha)
+    return tree
+
+
+def _verify_tree(tree: str, sha: str) -> None:
+    """Raises RuntimeError if the checkout in `tree` is not complete."""
+    head = get_head_sha(tree)
+    if head != sha:
+        raise RuntimeError(f"The commands in '{tree}' are at {head}, expected {sha}.")
+    out = run_cmd(["git", "-C", tree, "submodule", "status", "--recursive"])
+    # missing, out of sync, or conflicting submodules
+    broken = [line for line in (out or "").split("\n") if line[:1] in ("-", "+", "U")]
+    if broken:
+        raise RuntimeError(f"The submodules of the commands in '{tree}' are not checked out: {broken}")
+    if not get_commands_index(tree).get_commands(all_commands=True):
+        raise RuntimeError(f"No commands found in '{tree}'.")
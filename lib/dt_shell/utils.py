@@ -1,8 +1,8 @@
+import os
 import subprocess
 import traceback
-from typing import Optional
-
-import termcolor
+from contextlib import contextmanager
+from typing import Iterator, Optional
 
 from . import dtslogger
 
@@ -83,6 +83,7 @@ def raise_type_mismatch(ob, expected, **kwargs):
     raise ValueError(e)
 
 
+# used to pass arguments with spaces in a single command line, kept for the callers of `DTShell.onecmd`
 SPACE_TAG = "SPACE_TAG"
 
 
@@ -99,14 +100,20 @@ def format_exception(e):
 
 
 def href(x):
+    import termcolor
+
     return termcolor.colored(x, "blue", None, ["underline"])
 
 
 def dark_yellow(x):
+    import termcolor
+
     return termcolor.colored(x, "yellow")
 
 
 def dark(x):
+    import termcolor
+
     return termcolor.colored(x, attrs=["dark"])
 
 
@@ -125,3 +132,28 @@ def run_cmd(cmd, print_output=False, suppress_errors=False):
     if print_output:
         print(stdout)
     return stdout
+
+
+@contextmanager
+def file_lock(path: str, blocking: bool = True) -> Iterator[bool]:
+    """Holds an exclusive lock on the file `path` (shared by all the processes), yields whether it got it.
+
+    If `blocking` is False, it does not wait for the processes holding the lock.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        # no advisory locks (e.g., Windows)
+        yield True
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as fp:
+        try:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fp.fileno(), fcntl.LOCK_UN)
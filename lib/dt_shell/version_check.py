@@ -1,101 +1,57 @@
 # -*- coding: utf-8 -*-
 import json
-import os
-import subprocess
 from datetime import datetime, timedelta
 from typing import Optional, Tuple
 
-import termcolor
-import yaml
-from whichcraft import which
 
-from . import __version__, dtslogger
-from .constants import DTShellConstants
+from . import __version__
 from .exceptions import CouldNotGetVersion, NoCacheAvailable, URLException
+from .network import get_url_cached
+from .network import get_url  # noqa: F401 (it used to be defined here)
+from .state import read_state, update_state
 
 
-def get_url(url, timeout=3):
-    from six.moves import urllib
-
-    try:
-        req = urllib.request.Request(url)
-        res = urllib.request.urlopen(req, timeout=timeout)
-        content = res.read()
-        if res.getcode() != 200:
-            raise URLException(str(res))
-        return content.decode("utf-8")
-    except urllib.error.URLError:
-        dtslogger.debug("Falling back to using curl because urllib failed.")
-        if which("curl") is not None:
-            cmd = ["curl", url, "-m", "2"]
-            try:
-                data = subprocess.check_output(cmd, stderr=subprocess.PIPE)
-                return data
-            except subprocess.CalledProcessError as e:
-                msg = "Could not call %s: %s" % (cmd, e)
-                raise URLException(msg)
-        else:
-            msg = "curl not available"
-            raise URLException(msg)
-
-
-def get_last_version_fresh() -> str:
+def get_last_version_fresh(deadline: Optional[float] = None) -> str:
     url = "https://pypi.org/pypi/duckietown-shell/json"
 
     try:
         try:
-            data = get_url(url)
+            # the (large) JSON is only downloaded and parsed again when it changed
+            return get_url_cached(url, _extract_version, deadline=deadline)
         except URLException as e:
             raise CouldNotGetVersion(str(e))
-        try:
-            info = json.loads(data)
-        except BaseException as e:
-            msg = "Could not read json %r" % data
-            raise CouldNotGetVersion(msg) from e
-
-        last_version = info["info"]["version"]
-        return last_version
     except CouldNotGetVersion:
         raise
     except BaseException as e:
         raise CouldNotGetVersion() from e
 
 
-def get_cache_filename() -> str:
-    d0 = os.path.expanduser(DTShellConstants.ROOT)
-    return os.path.join(d0, "pypi-cache.yaml")
+def _extract_version(data: str) -> str:
+    try:
+        info = json.loads(data)
+    except BaseException as e:
+        msg = "Could not read json %r" % data
+        raise CouldNotGetVersion(msg) from e
+    return info["info"]["version"]
 
 
 def read_cache() -> Tuple[str, datetime]:
     try:
-        fn = get_cache_filename()
-        if os.path.exists(fn):
-            data = open(fn).read()
-            interpreted = yaml.load(data, Loader=yaml.Loader)
-            version = interpreted["version"]
-            dt = interpreted["timestamp"]
-            return version, dt
-        else:
-            msg = "File %s does not exist." % fn
-            raise NoCacheAvailable(msg)
+        cache = read_state()["pypi"]
+        return cache["version"], datetime.fromtimestamp(cache["timestamp"])
     except Exception as e:
         msg = "Could not read cache: %s" % e
         raise NoCacheAvailable(msg)
 
 
 def write_cache(version: str, dt: datetime) -> None:
-    fn = get_cache_filename()
-    d0 = os.path.dirname(fn)
-    if not os.path.exists(d0):
-        os.makedirs(d0)
+    def update(state: dict) -> None:
+        state["pypi"] = dict(version=version, timestamp=dt.timestamp())
 
-    with open(fn, "w") as f:
-        contents = dict(version=version, timestamp=dt)
-        y = yaml.dump(contents)
-        f.write(y)
+    update_state(update)
 
 
-def get_last_version() -> Optional[str]:
+def get_last_version(deadline: Optional[float] = None) -> Optional[str]:
     now = datetime.now()
     update = False
 
@@ -115,7 +71,7 @@ def get_last_version() -> Optional[str]:
     if update:
         # dtslogger.debug('Getting last version from PyPI.')
         try:
-            version = get_last_version_fresh()
+            version = get_last_version_fresh(deadline)
             write_cache(version, now)
             return version
         except CouldNotGetVersion:
@@ -133,11 +89,20 @@ def is_older(a: str, b: str) -> bool:
 
 
 def check_if_outdated() -> None:
-    latest_version = get_last_version()
+    msg = get_outdated_message()
+    if msg is not None:
+        import termcolor
+
+        print(termcolor.colored(msg, "yellow"))
+
+
+def get_outdated_message(deadline: Optional[float] = None) -> Optional[str]:
+    """Returns the message to show if a newer version of the shell is available, None otherwise."""
+    latest_version = get_last_version(deadline)
     # print('last version: %r' % latest_version)
     # print('installed: %r' % __version__)
     if latest_version and is_older(__version__, latest_version):
-        msg = """
+        return """
 
 There is an updated duckietown-shell available.
 
@@ -154,4 +119,4 @@ You can update the shell using `pip`. Run the following command:
         """.format(
             current=__version__, available=latest_version
         )
-        print(termcolor.colored(msg, "yellow"))
+    return None
@@ -0,0 +1,197 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+from typing import Dict, Optional, Set
+
+from . import dtslogger
+
+__all__ = ["CommandsWatcher"]
+
+# seconds between two scans of the commands tree when inotify is not available
+POLLING_INTERVAL_SECS = 1.0
+
+# inotify constants (see inotify(7))
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class CommandsWatcher:
+    """Watches a commands tree in the background and collects the first-level commands that changed.
+
+    Events are accumulated until `pop_changes` is called, so that a burst of changes (e.g., an editor
+    saving several files) results in a single reload.
+    """
+
+    def __init__(self, commands_path: str):
+        self.commands_path = os.path.abspath(commands_path)
+        self._changes: Set[str] = set()
+        self._lock = threading.Lock()
+        self._backend = None
+
+    def start(self) -> None:
+        if self._backend is not None:
+            return
+        try:
+            self._backend = _InotifyBackend(self.commands_path, self._on_change)
+        except OSError as e:
+            dtslogger.debug(f"Cannot use inotify ({e}), polling the commands for changes instead.")
+            self._backend = _PollingBackend(self.commands_path, self._on_change)
+        self._backend.start()
+
+    def stop(self) -> None:
+        if self._backend is not None:
+            self._backend.stop()
+            self._backend = None
+
+    def pop_changes(self) -> Set[str]:
+        """Returns the first-level commands that changed since the last call."""
+        # cheap check first, this is called before every prompt
+        if not self._changes:
+            return set()
+        with self._lock:
+            changes, self._changes = self._changes, set()
+        return changes
+
+    def _on_change(self, path: str) -> None:
+        rel = os.path.relpath(path, self.commands_path)
+        parts = rel.split(os.sep)
+        if rel.startswith("..") or any(p.startswith(".") or p == "__pycache__" for p in parts):
+            return
+        if parts[-1].endswith((".pyc", "~")):
+            return
+        with self._lock:
+            self._changes.add(parts[0])
+
+
+def _ignored_dir(name: str) -> bool:
+    return name == "__pycache__" or name.startswith(".")
+
+
+class _InotifyBackend:
+    def __init__(self, root: str, callback):
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._callback = callback
+        self._watches: Dict[int, str] = {}
+        self._stop_r, self._stop_w = os.pipe()
+        self._thread = threading.Thread(target=self._run, name="dts-watcher", daemon=True)
+        try:
+            self._add_tree(root)
+        except OSError:
+            self._close()
+            raise
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        os.write(self._stop_w, b"x")
+        self._thread.join()
+        self._close()
+
+    def _close(self) -> None:
+        for fd in [self._fd, self._stop_r, self._stop_w]:
+            os.close(fd)
+
+    def _add_tree(self, root: str) -> None:
+        for path, dirs, _ in os.walk(root):
+            dirs[:] = [d for d in dirs if not _ignored_dir(d)]
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                err = ctypes.get_errno()
+                # e.g., ENOSPC when we run out of watches
+                raise OSError(err, "%s: %s" % (path, os.strerror(err)))
+            self._watches[wd] = path
+
+    def _run(self) -> None:
+        while True:
+            ready, _, _ = select.select([self._fd, self._stop_r], [], [])
+            if self._stop_r in ready:
+                return
+            data = os.read(self._fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                offset += length
+                self._handle_event(wd, mask, name)
+
+    def _handle_event(self, wd: int, mask: int, name: str) -> None:
+        if mask & IN_Q_OVERFLOW:
+            # we lost events, consider everything changed
+            for path in self._watches.values():
+                self._callback(path)
+            return
+        directory = self._watches.get(wd)
+        if directory is None:
+            return
+        if mask & IN_IGNORED:
+            # the directory was removed
+            del self._watches[wd]
+            return
+        path = os.path.join(directory, name) if name else directory
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and not _ignored_dir(name):
+            try:
+                self._add_tree(path)
+            except OSError as e:
+                dtslogger.debug(f"Cannot watch '{path}': {e}")
+        self._callback(path)
+
+
+class _PollingBackend:
+    def __init__(self, root: str, callback):
+        self._root = root
+        self._callback = callback
+        self._stopped = threading.Event()
+        self._snapshot = self._scan()
+        self._thread = threading.Thread(target=self._run, name="dts-watcher", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def _scan(self) -> Dict[str, Optional[int]]:
+        snapshot = {}
+        for path, dirs, files in os.walk(self._root):
+            dirs[:] = [d for d in dirs if not _ignored_dir(d)]
+            for f in files:
+                p = os.path.join(path, f)
+                try:
+                    snapshot[p] = os.stat(p).st_mtime_ns
+                except OSError:
+                    snapshot[p] = None
+        return snapshot
+
+    def _run(self) -> None:
+        while not self._stopped.wait(POLLING_INTERVAL_SECS):
+            snapshot = self._scan()
+            for p in set(snapshot) | set(self._snapshot):
+                if snapshot.get(p) != self._snapshot.get(p):
+                    self._callback(p)
+            self._snapshot = snapshot
@@ -0,0 +1,41 @@
+import os
+from concurrent.futures.process import BrokenProcessPool
+
+from dt_shell import bytecode
+
+
+class BrokenExecutor:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def map(self, *args, **kwargs):
+        # a worker was killed (e.g., out of memory)
+        raise BrokenProcessPool("A process in the process pool was terminated abruptly")
+
+
+def _commands(tmp_path) -> str:
+    os.makedirs(tmp_path / "hello")
+    with open(tmp_path / "hello" / "command.py", "w") as fp:
+        fp.write("x = 1\n")
+    return str(tmp_path)
+
+
+def test_precompile_commands(tmp_path, monkeypatch):
+    monkeypatch.delenv("DTSHELL_PYCACHE_PREFIX", raising=False)
+    commands_path = _commands(tmp_path)
+    bytecode.precompile_commands(commands_path)
+    assert os.listdir(os.path.join(commands_path, "hello", "__pycache__"))
+
+
+def test_broken_workers_are_not_fatal(tmp_path, monkeypatch):
+    monkeypatch.delenv("DTSHELL_PYCACHE_PREFIX", raising=False)
+    monkeypatch.setattr(bytecode, "ProcessPoolExecutor", BrokenExecutor)
+    commands_path = _commands(tmp_path)
+    bytecode.precompile_commands(commands_path)
+    assert not os.path.exists(os.path.join(commands_path, "hello", "__pycache__"))
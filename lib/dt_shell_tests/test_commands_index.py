@@ -0,0 +1,143 @@
+import glob
+import os
+from typing import Dict, Optional
+
+import pytest
+
+from dt_shell import commands_index, state
+from dt_shell.commands_index import get_commands_index, set_user_installed
+
+SHA1 = "1" * 40
+SHA2 = "2" * 40
+
+
+@pytest.fixture(autouse=True)
+def config_path(tmp_path, monkeypatch):
+    path = str(tmp_path / "config")
+    monkeypatch.setattr(commands_index, "get_config_path", lambda: path)
+    monkeypatch.setattr(state, "get_state_file", lambda: os.path.join(path, "state.json"))
+    monkeypatch.setattr(state, "_cache", None)
+    return path
+
+
+def _touch(path: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w"):
+        pass
+
+
+def _commands(tmp_path) -> str:
+    root = str(tmp_path / "commands")
+    for fn in [
+        "devel/installed.flag",
+        "devel/build/command.py",
+        "devel/run/command.py",
+        "devel/run/fast/command.py",
+        "devel/empty/README.md",
+        "docs/command.py",
+        "docs/installed.user.flag",
+        "other/command.py",
+        "lib/library/command.py",
+        "lib/library/installed.flag",
+        "nothing/README.md",
+        ".hidden/command.py",
+        ".hidden/installed.flag",
+    ]:
+        _touch(os.path.join(root, fn))
+    _write_head(root, SHA1)
+    return root
+
+
+def _write_head(root: str, sha: str) -> None:
+    os.makedirs(os.path.join(root, ".git"), exist_ok=True)
+    with open(os.path.join(root, ".git", "HEAD"), "w") as fp:
+        fp.write(sha + "\n")
+
+
+def _old_get_commands(path: str, lvl=0, all_commands=False) -> Optional[Dict[str, object]]:
+    # how the commands were found before there was an index
+    entries = glob.glob(os.path.join(path, "*"))
+    files = [os.path.basename(e) for e in entries if os.path.isfile(e)]
+    dirs = [e for e in entries if os.path.isdir(e) and (lvl > 0 or os.path.basename(e) != "lib")]
+    if "command.py" not in files and not dirs:
+        return None
+    if (
+        not all_commands
+        and lvl == 1
+        and ("installed.flag" not in files and "installed.user.flag" not in files)
+    ):
+        return None
+    subcmds = {}
+    for d in dirs:
+        f = _old_get_commands(d, lvl + 1, all_commands)
+        if f is not None:
+            subcmds[os.path.basename(d)] = f
+    if "command.py" not in files and not subcmds:
+        return None
+    return subcmds
+
+
+def test_commands_match_the_old_walk(tmp_path):
+    root = _commands(tmp_path)
+    index = get_commands_index(root)
+    assert index.get_commands() == _old_get_commands(root)
+    assert index.get_commands() == {"devel": {"build": {}, "run": {"fast": {}}}, "docs": {}}
+    assert index.get_commands(all_commands=True) == _old_get_commands(root, all_commands=True)
+    assert set(index.get_commands(all_commands=True)) == {"devel", "docs", "other"}
+    # the index is read back from disk
+    assert get_commands_index(root) == index
+
+
+def test_commands_installed_by_the_user(tmp_path):
+    root = _commands(tmp_path)
+    set_user_installed(root, "other", True)
+    assert set(get_commands_index(root).get_commands()) == {"devel", "docs", "other"}
+    set_user_installed(root, "other", False)
+    assert set(get_commands_index(root).get_commands()) == {"devel", "docs"}
+
+
+def _bump_mtime(path: str) -> None:
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def test_index_is_invalidated(tmp_path):
+    root = _commands(tmp_path)
+    index = get_commands_index(root)
+    assert index.sha == SHA1 and index.is_valid()
+    # a directory changed
+    _bump_mtime(os.path.join(root, "devel", "run"))
+    assert not index.is_valid()
+    index = get_commands_index(root)
+    assert index.is_valid()
+    # the HEAD of the repository moved
+    _write_head(root, SHA2)
+    assert not index.is_valid()
+    index = get_commands_index(root)
+    assert index.sha == SHA2 and index.is_valid()
+    # a command was installed
+    _touch(os.path.join(root, "other", "installed.flag"))
+    assert not index.is_valid()
+    index = get_commands_index(root)
+    assert set(index.get_commands()) == {"devel", "docs", "other"}
+    # and uninstalled
+    os.remove(os.path.join(root, "devel", "installed.flag"))
+    assert not index.is_valid()
+    index = get_commands_index(root)
+    assert set(index.get_commands()) == {"docs", "other"}
+    assert index.get_commands() == _old_get_commands(root)
+    # a directory was removed
+    os.remove(os.path.join(root, "devel", "empty", "README.md"))
+    os.rmdir(os.path.join(root, "devel", "empty"))
+    assert not index.is_valid()
+
+
+def test_modules_of_the_commands(tmp_path):
+    root = _commands(tmp_path)
+    _touch(os.path.join(root, "lib", "helpers.py"))
+    modules = get_commands_index(root).modules
+    assert modules["devel"] == root
+    assert modules["library"] == os.path.join(root, "lib")
+    assert modules["helpers"] == os.path.join(root, "lib")
+    # `lib` is where the libraries are, not a library
+    assert "lib" not in modules and ".hidden" not in modules
@@ -0,0 +1,108 @@
+import os
+import subprocess
+
+import pytest
+
+from dt_shell import commands_index, update_utils
+from dt_shell.commands_trees import (
+    activate_tree,
+    collect_trees,
+    get_staging_tree,
+    get_trees_dir,
+    lease_tree,
+    migrate_commands_tree,
+)
+
+SHA = "0123456789abcdef" * 2 + "01234567"
+
+
+@pytest.fixture(autouse=True)
+def config_path(tmp_path, monkeypatch):
+    # the locks and the indices of the commands are kept in the config dir
+    path = str(tmp_path / "config")
+    monkeypatch.setattr(update_utils, "get_config_path", lambda: path)
+    monkeypatch.setattr(commands_index, "get_config_path", lambda: path)
+    return path
+
+
+def _commands(tmp_path) -> str:
+    return str(tmp_path.resolve() / "commands-multi" / "daffy")
+
+
+def _tree(commands_path: str, name: str) -> str:
+    tree = os.path.join(get_trees_dir(commands_path), name)
+    os.makedirs(os.path.join(tree, "hello"))
+    with open(os.path.join(tree, "hello", "command.py"), "w"):
+        pass
+    return tree
+
+
+def test_leased_trees_are_not_removed(tmp_path):
+    commands_path = _commands(tmp_path)
+    old, new, unused = [_tree(commands_path, name) for name in [SHA[:12], "new", "unused"]]
+    activate_tree(commands_path, old)
+    tree, lease = lease_tree(commands_path)
+    assert tree == old and lease is not None
+    activate_tree(commands_path, new)
+    # the shell keeps using the tree it leased, which is never reused for an update
+    collect_trees(commands_path)
+    assert os.path.isdir(old) and os.path.isdir(new)
+    assert not os.path.exists(unused)
+    assert get_staging_tree(commands_path, SHA) == old + "-1"
+    lease.close()
+    assert get_staging_tree(commands_path, SHA) == old
+    collect_trees(commands_path)
+    assert os.listdir(get_trees_dir(commands_path)) == ["new"]
+    # the active tree is never reused nor removed
+    assert get_staging_tree(commands_path, "new") == new + "-1"
+
+
+def test_lease_follows_the_active_tree(tmp_path):
+    commands_path = _commands(tmp_path)
+    activate_tree(commands_path, _tree(commands_path, "a"))
+    assert lease_tree(commands_path)[0] == os.path.realpath(commands_path)
+    # commands that are not in a tree are not leased
+    other = str(tmp_path / "my-commands")
+    os.makedirs(other)
+    assert lease_tree(other) == (other, None)
+
+
+def test_migrate_commands_tree(tmp_path):
+    commands_path = _commands(tmp_path)
+    os.makedirs(os.path.join(commands_path, "hello"))
+    # a tree with the same name is not overwritten
+    existing = _tree(commands_path, "commands")
+    migrate_commands_tree(commands_path)
+    assert os.path.islink(commands_path)
+    assert os.path.realpath(commands_path) == existing + "-1"
+    assert os.path.isfile(os.path.join(existing, "hello", "command.py"))
+    # nothing to do the second time
+    migrate_commands_tree(commands_path)
+    assert os.path.realpath(commands_path) == existing + "-1"
+
+
+def test_verify_tree_without_submodules(tmp_path, monkeypatch):
+    for var in ["GIT_AUTHOR_NAME", "GIT_COMMITTER_NAME", "GIT_AUTHOR_EMAIL", "GIT_COMMITTER_EMAIL"]:
+        monkeypatch.setenv(var, "dts")
+    tree = _tree(_commands(tmp_path), "tree")
+    git = ["git", "-C", tree]
+    subprocess.check_call(git + ["init", "-q"])
+    subprocess.check_call(git + ["add", "."])
+    subprocess.check_call(git + ["commit", "-q", "-m", "commands"])
+    sha = subprocess.check_output(git + ["rev-parse", "HEAD"]).decode().strip()
+    update_utils._verify_tree(tree, sha)
+    with pytest.raises(RuntimeError):
+        update_utils._verify_tree(tree, "0" * 40)
+
+
+def test_collected_trees_lose_their_index(tmp_path, config_path):
+    commands_path = _commands(tmp_path)
+    old, new = _tree(commands_path, "old"), _tree(commands_path, "new")
+    activate_tree(commands_path, old)
+    index_file = commands_index.get_commands_index_file(old)
+    commands_index.get_commands_index(old)
+    assert os.path.isfile(index_file)
+    activate_tree(commands_path, new)
+    collect_trees(commands_path)
+    assert not os.path.exists(old)
+    assert not os.path.exists(index_file)
@@ -0,0 +1,144 @@
+from types import SimpleNamespace
+
+from dt_shell.commands_registry import CommandsRegistry
+from dt_shell.completion import CompletionCache, PrefixTrie
+from dt_shell.dt_command_abs import DTCommandAbs
+
+
+class RunCommand(DTCommandAbs):
+    @staticmethod
+    def command(shell, args):
+        pass
+
+    @staticmethod
+    def complete(shell, word, line):
+        return ["--fast", "--slow", "--force"]
+
+
+def _registry() -> CommandsRegistry:
+    registry = CommandsRegistry()
+    registry.add("devel", {"build": {}, "buildx": {}, "run": {}})
+    registry.add("docs", {"build": {}})
+    registry.find(["devel", "run"])._klass = RunCommand
+    return registry
+
+
+def _complete(registry: CommandsRegistry, line: str, shell=None):
+    shell = shell or SimpleNamespace(registry=registry)
+    word = "" if line.endswith(" ") else line.split()[-1]
+    command = registry.commands[line.split()[0]]
+    return command.complete_command(shell, word, line, len(line) - len(word), len(line))
+
+
+def test_trie_find():
+    trie = PrefixTrie(["build", "buildx", "run", "bu"])
+    assert trie.find("bu") == ["build", "buildx", "bu"]
+    assert trie.find("build") == ["build", "buildx"]
+    assert trie.find("buildx") == ["buildx"]
+    assert trie.find("r") == ["run"]
+    assert trie.find("x") == []
+    assert trie.find("") == ["build", "buildx", "run", "bu"]
+
+
+def test_trie_add():
+    trie = PrefixTrie()
+    assert trie.find("") == []
+    trie.add("devel")
+    trie.add("docs")
+    assert trie.find("d") == ["devel", "docs"]
+    assert trie.find("do") == ["docs"]
+
+
+def test_complete_sub_commands():
+    registry = _registry()
+    assert _complete(registry, "devel ") == ["build", "buildx", "run"]
+    assert _complete(registry, "devel bu") == ["build", "buildx"]
+    assert _complete(registry, "devel buildx") == ["buildx"]
+    assert _complete(registry, "devel x") == []
+    assert _complete(registry, "docs ") == ["build"]
+
+
+def test_complete_leaf_command():
+    registry = _registry()
+    assert _complete(registry, "devel run ") == ["--fast", "--slow", "--force"]
+    assert _complete(registry, "devel run --f") == ["--fast", "--force"]
+    # only the word right after the command is completed
+    assert _complete(registry, "devel run --fast --s") == []
+    # unknown sub-command
+    assert _complete(registry, "devel nope ") == []
+
+
+def test_root_completions_follow_the_registry():
+    registry = _registry()
+    assert registry.root.completions.find("d") == ["devel", "docs"]
+    registry.remove("docs")
+    assert registry.root.completions.find("d") == ["devel"]
+    registry.add("dev", None)
+    assert registry.root.completions.find("dev") == ["devel", "dev"]
+
+
+def test_completions_depend_on_the_word():
+    calls = []
+
+    class PathCommand(RunCommand):
+        @staticmethod
+        def complete(shell, word, line):
+            calls.append((word, line))
+            return [p for p in ["/etc/passwd", "/etc/hosts", "/home"] if p.startswith(word)]
+
+    registry = _registry()
+    registry.find(["devel", "run"])._klass = PathCommand
+    shell = SimpleNamespace(registry=registry, completion_cache=CompletionCache())
+    assert _complete(registry, "devel run /etc/pass", shell) == ["/etc/passwd"]
+    assert _complete(registry, "devel run /etc/", shell) == ["/etc/passwd", "/etc/hosts"]
+    assert _complete(registry, "devel run /etc/pass", shell) == ["/etc/passwd"]
+    # the command gets the word, each word is cached
+    assert calls == [("/etc/pass", "run /etc/pass"), ("/etc/", "run /etc/")]
+
+
+def test_completions_are_cached_by_line():
+    calls = []
+
+    class CountingCommand(RunCommand):
+        completions_by_line = True
+
+        @staticmethod
+        def complete(shell, word, line):
+            calls.append((word, line))
+            return RunCommand.complete(shell, word, line)
+
+    registry = _registry()
+    registry.find(["devel", "run"])._klass = CountingCommand
+    shell = SimpleNamespace(registry=registry, completion_cache=CompletionCache())
+    assert _complete(registry, "devel run ", shell) == ["--fast", "--slow", "--force"]
+    assert _complete(registry, "devel run --", shell) == ["--fast", "--slow", "--force"]
+    assert _complete(registry, "devel run --f", shell) == ["--fast", "--force"]
+    assert _complete(registry, "devel run --fo", shell) == ["--force"]
+    # the command is asked once, for the line without the word being typed
+    assert calls == [("", "run")]
+
+
+def test_completion_scripts_use_static_completions_only():
+    from dt_shell.completion_scripts import generate_completion_script, get_completion_table
+
+    class BuildCommand(RunCommand):
+        static_completions = ["--push", "--no-cache", "not safe"]
+
+        @staticmethod
+        def complete(shell, word, line):
+            raise AssertionError("complete() is not used by the completion scripts")
+
+    registry = _registry()
+    registry.find(["devel", "build"])._klass = BuildCommand
+    registry.find(["devel", "buildx"])._klass = BuildCommand
+    registry.find(["docs", "build"])._klass = RunCommand
+    table = get_completion_table(registry, ["help", "devel"])
+    assert table == {
+        "": ["devel", "docs", "help"],
+        "devel": ["build", "buildx", "run"],
+        "devel build": ["--push", "--no-cache"],
+        "devel buildx": ["--push", "--no-cache"],
+        "docs": ["build"],
+    }
+    script = generate_completion_script("bash", table)
+    assert '"devel build") COMPREPLY=($(compgen -W "--push --no-cache" -- "$cur")) ;;' in script
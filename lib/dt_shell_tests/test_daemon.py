@@ -0,0 +1,48 @@
+import os
+import time
+
+from dt_shell import daemon
+
+
+def test_shell_env():
+    env = {
+        "HOME": "/home/duckie",
+        "PATH": "/usr/bin",
+        "DTSHELL_COMMANDS": "cmds2",
+        "DTSHELL_WATCH": "1",
+        "DTSHELL_SERVER_SOCKET": "/tmp/dts.sock",
+    }
+    assert daemon.get_shell_env(env, "/work") == {
+        "HOME": "/home/duckie",
+        "DTSHELL_COMMANDS": "/work/cmds2",
+        "DTSHELL_WATCH": "1",
+    }
+
+
+def test_clients_with_another_shell_are_declined():
+    shell_env = daemon.get_shell_env({"HOME": "/home/duckie", "DTSHELL_COMMANDS": "cmds"}, "/work")
+
+    def check(env: dict, cwd: str = "/work"):
+        return daemon._check_shell_env({"env": env, "cwd": cwd}, shell_env)
+
+    assert check({"HOME": "/home/duckie", "DTSHELL_COMMANDS": "cmds", "PATH": "/bin"}) is None
+    assert check({"HOME": "/home/duckie", "DTSHELL_COMMANDS": "../cmds"}, "/work/sub") is None
+    assert "DTSHELL_COMMANDS" in check({"HOME": "/home/duckie", "DTSHELL_COMMANDS": "cmds2"})
+    assert "DTSHELL_COMMANDS" in check({"HOME": "/home/duckie"})
+    assert "HOME" in check({"HOME": "/root", "DTSHELL_COMMANDS": "cmds"})
+    assert "DTSHELL_DEBUG" in check(
+        {"HOME": "/home/duckie", "DTSHELL_COMMANDS": "cmds", "DTSHELL_DEBUG": "1"}
+    )
+
+
+def test_only_forked_children_are_reaped():
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0)
+    daemon._children.add(pid)
+    for _ in range(100):
+        daemon._reap_children()
+        if pid not in daemon._children:
+            break
+        time.sleep(0.01)
+    assert pid not in daemon._children
@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+from dt_shell.commands_registry import CommandsRegistry
+from dt_shell.dt_command_abs import DTCommandAbs
+
+
+def _shell(calls: list):
+    class BuildCommand(DTCommandAbs):
+        @staticmethod
+        def command(shell, args):
+            calls.append(args)
+
+    registry = CommandsRegistry()
+    registry.add("devel", {"build": {}, "run": {}})
+    registry.find(["devel", "build"])._klass = BuildCommand
+    return SimpleNamespace(registry=registry, onecmd=lambda line: calls.append(line))
+
+
+def test_onecmd_argv_passes_arguments_unchanged():
+    from dt_shell.cli import DTShell
+
+    calls = []
+    shell = _shell(calls)
+    DTShell.onecmd_argv(shell, ["devel", "build", "a b", "SPACE_TAG", "--x='y'"])
+    assert calls == [["a b", "SPACE_TAG", "--x='y'"]]
+    # commands implemented by the shell itself get a line quoted back
+    DTShell.onecmd_argv(shell, ["help", "a b"])
+    assert calls[-1] == "help 'a b'"
+
+
+def test_interactive_line_is_split_like_a_shell():
+    calls = []
+    shell = _shell(calls)
+    node = shell.registry.commands["devel"]
+    node.do_command(shell, "build \"a b\" 'c d' e\\ f g")
+    assert calls == [["a b", "c d", "e f", "g"]]
+    # older callers encode the spaces
+    node.do_command(shell, "build aSPACE_TAGb")
+    assert calls[-1] == ["a b"]
+
+
+def test_interactive_line_with_unbalanced_quote(capsys):
+    calls = []
+    shell = _shell(calls)
+    shell.registry.commands["devel"].do_command(shell, 'build "a b')
+    assert calls == []
+    assert "Cannot parse the command line" in capsys.readouterr().out
+
+
+def test_unknown_sub_command(capsys):
+    calls = []
+    shell = _shell(calls)
+    shell.registry.commands["devel"].run(shell, ["nope"])
+    assert calls == []
+    assert "Command `nope` not recognized" in capsys.readouterr().out
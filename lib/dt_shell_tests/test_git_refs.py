@@ -0,0 +1,88 @@
+import os
+
+from dt_shell import utils
+from dt_shell.git_refs import find_git_dir, get_head_sha, read_ref
+
+SHA1 = "1" * 40
+SHA2 = "2" * 40
+SHA3 = "3" * 40
+
+
+def _write(path, content: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fp:
+        fp.write(content)
+
+
+def _repo(root) -> str:
+    git_dir = os.path.join(root, ".git")
+    _write(os.path.join(git_dir, "HEAD"), "ref: refs/heads/master\n")
+    return git_dir
+
+
+def test_loose_ref(tmp_path):
+    git_dir = _repo(tmp_path)
+    _write(os.path.join(git_dir, "refs", "heads", "master"), SHA1 + "\n")
+    assert find_git_dir(str(tmp_path)) == git_dir
+    assert read_ref(git_dir, "refs/heads/master") == SHA1
+    assert get_head_sha(str(tmp_path)) == SHA1
+
+
+def test_packed_refs(tmp_path):
+    git_dir = _repo(tmp_path)
+    packed = [
+        "# pack-refs with: peeled fully-peeled sorted",
+        f"{SHA1} refs/heads/master",
+        f"{SHA2} refs/tags/v1",
+        f"^{SHA3}",
+        "",
+    ]
+    _write(os.path.join(git_dir, "packed-refs"), "\n".join(packed))
+    assert get_head_sha(str(tmp_path)) == SHA1
+    # the peeled line is the commit the tag points to, not a ref
+    assert read_ref(git_dir, "refs/tags/v1") == SHA2
+    # loose refs take precedence over packed ones
+    _write(os.path.join(git_dir, "refs", "heads", "master"), SHA3)
+    assert get_head_sha(str(tmp_path)) == SHA3
+
+
+def test_symbolic_and_detached_head(tmp_path):
+    git_dir = _repo(tmp_path)
+    _write(os.path.join(git_dir, "refs", "heads", "daffy"), SHA2)
+    _write(os.path.join(git_dir, "refs", "heads", "master"), "ref: refs/heads/daffy")
+    assert get_head_sha(str(tmp_path)) == SHA2
+    _write(os.path.join(git_dir, "HEAD"), SHA1)
+    assert get_head_sha(str(tmp_path)) == SHA1
+
+
+def test_worktree(tmp_path):
+    main_dir = _repo(tmp_path / "main")
+    _write(os.path.join(main_dir, "refs", "heads", "master"), SHA1)
+    wt_dir = os.path.join(main_dir, "worktrees", "tree")
+    _write(os.path.join(wt_dir, "HEAD"), "ref: refs/heads/master\n")
+    _write(os.path.join(wt_dir, "commondir"), "../..\n")
+    # the worktree points to its git directory with a `.git` file
+    tree = tmp_path / "tree"
+    _write(os.path.join(tree, ".git"), f"gitdir: {os.path.relpath(wt_dir, tree)}\n")
+    assert find_git_dir(str(tree)) == os.path.normpath(wt_dir)
+    # the refs are shared with the main repository, HEAD is not
+    assert get_head_sha(str(tree)) == SHA1
+    _write(os.path.join(wt_dir, "HEAD"), SHA2)
+    assert get_head_sha(str(tree)) == SHA2
+    assert get_head_sha(str(tmp_path / "main")) == SHA1
+
+
+def test_not_a_repository(tmp_path):
+    assert find_git_dir(str(tmp_path)) is None
+    assert get_head_sha(str(tmp_path)) is None
+    _write(os.path.join(tmp_path, ".git"), "not a gitdir\n")
+    assert find_git_dir(str(tmp_path)) is None
+
+
+def test_unresolved_head_asks_git(tmp_path, monkeypatch):
+    _repo(tmp_path)
+    # HEAD points to a branch that does not exist (yet), git prints nothing
+    monkeypatch.setattr(utils, "run_cmd", lambda *args, **kwargs: None)
+    assert get_head_sha(str(tmp_path)) is None
+    monkeypatch.setattr(utils, "run_cmd", lambda *args, **kwargs: f"{SHA1}\n")
+    assert get_head_sha(str(tmp_path)) == SHA1
@@ -0,0 +1,79 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+from dt_shell import commands_index, importer
+from dt_shell.commands_index import build_commands_index
+from dt_shell.importer import install_commands_finder
+
+
+@pytest.fixture(autouse=True)
+def clean_imports(tmp_path, monkeypatch):
+    monkeypatch.setattr(commands_index, "get_config_path", lambda: str(tmp_path / "config"))
+    monkeypatch.setattr(importer, "_finder", None)
+    meta_path, modules = list(sys.meta_path), set(sys.modules)
+    yield
+    sys.meta_path[:] = meta_path
+    for name in set(sys.modules) - modules:
+        del sys.modules[name]
+    importlib.invalidate_caches()
+
+
+def _write(path: str, content: str = "") -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as fp:
+        fp.write(content)
+
+
+def test_lib_takes_precedence_over_the_tree(tmp_path):
+    root = str(tmp_path / "commands")
+    _write(os.path.join(root, "finder_shared.py"), "WHERE = 'tree'\n")
+    _write(os.path.join(root, "finder_tree", "__init__.py"), "WHERE = 'tree'\n")
+    _write(os.path.join(root, "lib", "finder_shared", "__init__.py"), "WHERE = 'lib'\n")
+    _write(os.path.join(root, "lib", "finder_shared", "sub.py"), "WHERE = 'lib'\n")
+    install_commands_finder(build_commands_index(root).modules)
+    import finder_shared
+    import finder_shared.sub
+    import finder_tree
+
+    assert finder_shared.WHERE == "lib" and finder_shared.sub.WHERE == "lib"
+    assert finder_tree.WHERE == "tree"
+    # `lib` itself is not importable
+    with pytest.raises(ImportError):
+        importlib.import_module("lib")
+
+
+def test_namespace_dirs_do_not_shadow_modules(tmp_path, monkeypatch):
+    root = str(tmp_path / "commands")
+    # e.g., a command named like a module of the standard library
+    _write(os.path.join(root, "colorsys", "command.py"))
+    _write(os.path.join(root, "finder_namespace", "command.py"))
+    monkeypatch.delitem(sys.modules, "colorsys", raising=False)
+    install_commands_finder(build_commands_index(root).modules)
+    import colorsys
+    import finder_namespace.command
+
+    assert colorsys.__file__.endswith("colorsys.py")
+    assert hasattr(colorsys, "rgb_to_hsv")
+    # without a regular module, the directory is a namespace package
+    assert list(finder_namespace.__path__) == [os.path.join(root, "finder_namespace")]
+    assert finder_namespace.command.__file__ == os.path.join(root, "finder_namespace", "command.py")
+
+
+def test_reload_replaces_the_modules(tmp_path):
+    old, new = str(tmp_path / "old"), str(tmp_path / "new")
+    _write(os.path.join(old, "finder_old.py"))
+    _write(os.path.join(new, "finder_new.py"))
+    finder = install_commands_finder(build_commands_index(old).modules)
+    assert finder in sys.meta_path
+    assert install_commands_finder(build_commands_index(new).modules) is finder
+    assert sys.meta_path.count(finder) == 1
+    # right before the default path-based finder
+    assert sys.meta_path[sys.meta_path.index(finder) + 1] is importlib.machinery.PathFinder
+    import finder_new
+
+    assert finder_new.__file__ == os.path.join(new, "finder_new.py")
+    with pytest.raises(ImportError):
+        importlib.import_module("finder_old")
@@ -0,0 +1,49 @@
+import os
+import subprocess
+import sys
+
+import dt_shell
+
+# `import dt_shell` must stay cheap, it is paid by every `dts` call (including the ones served by
+# the shell server) and by every command that only needs the logger or the exceptions
+IMPORT_TIME_BUDGET_MS = 75
+
+HEAVY_MODULES = ["yaml", "termcolor", "cmd", "readline", "dt_shell.cli", "dt_shell.main"]
+
+
+def _run(code: str, *options: str) -> str:
+    cmd = [sys.executable, *options, "-c", code]
+    # make sure the child imports the same dt_shell we are testing
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(dt_shell.__file__)))
+    res = subprocess.run(cmd, check=True, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return res.stderr.decode()
+
+
+def _import_time_ms() -> float:
+    stderr = _run("import dt_shell", "-X", "importtime")
+    for line in stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if line.count("|") != 2:
+            continue
+        _, cumulative, name = line.split("|")
+        if name.strip() == "dt_shell":
+            return int(cumulative) / 1000.0
+    raise AssertionError(stderr)
+
+
+def test_import_is_light():
+    code = "import sys, dt_shell; sys.stderr.write(repr([m for m in %r if m in sys.modules]))" % HEAVY_MODULES
+    assert _run(code) == "[]"
+
+
+def test_lazy_names():
+    code = (
+        "import sys, dt_shell; from dt_shell import DTShell, DTCommandAbs; sys.stderr.write(DTShell.__name__)"
+    )
+    assert _run(code) == "DTShell"
+
+
+def test_import_time_budget():
+    # best of a few runs, to be robust to noise
+    elapsed = min(_import_time_ms() for _ in range(3))
+    assert elapsed < IMPORT_TIME_BUDGET_MS, f"import dt_shell took {elapsed:.1f} ms"
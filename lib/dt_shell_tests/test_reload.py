@@ -0,0 +1,118 @@
+import os
+import shutil
+import sys
+import time
+
+import pytest
+
+from dt_shell import commands_index, state
+from dt_shell.cli import DTShell
+from dt_shell.commands_registry import CommandsRegistry
+from dt_shell.commands_trees import activate_tree, get_trees_dir
+from dt_shell.completion import CompletionCache
+
+COMMAND = """\
+from dt_shell import DTCommandAbs
+
+
+class DTCommand(DTCommandAbs):
+    output = %r
+
+    @staticmethod
+    def command(shell, args):
+        print(DTCommand.output)
+"""
+
+
+def _command(tree: str, name: str, output: str) -> str:
+    path = os.path.join(tree, name)
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "installed.flag"), "w"):
+        pass
+    fn = os.path.join(path, "command.py")
+    with open(fn, "w") as fp:
+        fp.write(COMMAND % output)
+    return fn
+
+
+@pytest.fixture
+def make_shell(tmp_path, monkeypatch):
+    # a shell that only registers the commands, nothing is downloaded nor updated
+    monkeypatch.setattr(commands_index, "get_config_path", lambda: str(tmp_path / "config"))
+    monkeypatch.setattr(state, "get_state_file", lambda: str(tmp_path / "state.json"))
+    monkeypatch.setattr(state, "_cache", None)
+    shells = []
+
+    def make(commands_path: str) -> DTShell:
+        shell = DTShell.__new__(DTShell)
+        shell.registry = CommandsRegistry()
+        shell.completion_cache = CompletionCache()
+        shell.stale_leases = []
+        shell._lease_commands(commands_path)
+        shell.reload_commands()
+        shells.append(shell)
+        return shell
+
+    yield make
+    for shell in shells:
+        for command in list(shell.registry.commands):
+            shell._unload_command(command)
+
+
+def test_unchanged_commands_are_kept(tmp_path, make_shell):
+    _command(str(tmp_path), "keep_a", "A")
+    shell = make_shell(str(tmp_path))
+    node = shell.registry.commands["keep_a"]
+    klass = shell.registry.include.keep_a
+    shell.reload_commands()
+    assert shell.registry.commands["keep_a"] is node
+    assert shell.registry.include.keep_a is klass
+    assert hasattr(DTShell, "do_keep_a")
+
+
+def test_modified_commands_are_imported_again(tmp_path, make_shell, capsys):
+    fn = _command(str(tmp_path), "modified_a", "A")
+    shell = make_shell(str(tmp_path))
+    shell.onecmd("modified_a")
+    assert "modified_a.command" in sys.modules
+    _command(str(tmp_path), "modified_a", "B")
+    # in the future, it must look newer than the import even on filesystems with coarse timestamps
+    future = time.time() + 10
+    os.utime(fn, (future, future))
+    shell.reload_commands()
+    assert "modified_a.command" not in sys.modules
+    shell.onecmd("modified_a")
+    assert capsys.readouterr().out.split() == ["A", "B"]
+
+
+def test_removed_commands_are_unregistered(tmp_path, make_shell):
+    _command(str(tmp_path), "removed_a", "A")
+    _command(str(tmp_path), "removed_b", "B")
+    shell = make_shell(str(tmp_path))
+    _ = shell.registry.include.removed_a
+    assert all(hasattr(DTShell, f"{a}removed_a") for a in ["do_", "complete_", "help_"])
+    shutil.rmtree(os.path.join(tmp_path, "removed_a"))
+    shell.reload_commands()
+    assert list(shell.registry.commands) == ["removed_b"]
+    assert not any(hasattr(DTShell, f"{a}removed_a") for a in ["do_", "complete_", "help_"])
+    assert "removed_a.command" not in sys.modules
+
+
+def test_commands_of_a_new_tree_replace_the_old_ones(tmp_path, make_shell, capsys):
+    commands_path = str(tmp_path.resolve() / "commands-multi" / "daffy")
+    old, new = [os.path.join(get_trees_dir(commands_path), name) for name in ["A", "B"]]
+    _command(old, "tree_a", "A")
+    _command(new, "tree_a", "B")
+    activate_tree(commands_path, old)
+    shell = make_shell(commands_path)
+    shell.onecmd("tree_a")
+    # an update activates the other tree (as `dts update` does)
+    activate_tree(commands_path, new)
+    shell._lease_commands(commands_path)
+    # the old tree stays leased until its commands are unloaded
+    assert shell.commands_path == new and len(shell.stale_leases) == 1
+    shell.reload_commands()
+    assert shell.stale_leases == []
+    shell.onecmd("tree_a")
+    assert capsys.readouterr().out.split() == ["A", "B"]
+    assert sys.modules["tree_a.command"].__file__ == os.path.join(new, "tree_a", "command.py")
@@ -0,0 +1,121 @@
+import json
+import os
+import threading
+
+import pytest
+
+from dt_shell import state
+from dt_shell.commands_trees import get_commands_link
+
+
+@pytest.fixture
+def state_file(tmp_path, monkeypatch):
+    fn = str(tmp_path / "state.json")
+    monkeypatch.setattr(state, "get_state_file", lambda: fn)
+    monkeypatch.setattr(state, "_cache", None)
+    return fn
+
+
+def _increment(s: dict) -> None:
+    s["counter"] = s.get("counter", 0) + 1
+
+
+def test_update_state(state_file):
+    assert state.read_state() == {"schema": state.STATE_SCHEMA, "commands": {}}
+    state.update_commands_state("/commands", lambda s: s.update({"user-installed": ["a"]}))
+    assert state.get_commands_state("/commands") == {"user-installed": ["a"]}
+    with open(state_file) as fp:
+        assert json.load(fp)["commands"] == {"/commands": {"user-installed": ["a"]}}
+
+
+def test_concurrent_updates_are_not_lost(state_file):
+    def work():
+        for _ in range(10):
+            state.update_state(_increment)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert state.read_state()["counter"] == 40
+
+
+def test_failed_update_leaves_the_state_alone(state_file):
+    state.update_state(_increment)
+
+    def fail(s: dict) -> None:
+        s["counter"] = 10
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        state.update_state(fail)
+    assert state.read_state()["counter"] == 1
+
+    def unserializable(s: dict) -> None:
+        s["counter"] = object()
+
+    with pytest.raises(TypeError):
+        state.update_state(unserializable)
+    with open(state_file) as fp:
+        assert json.load(fp)["counter"] == 1
+
+
+def test_read_state_is_memoized(state_file):
+    state.update_state(_increment)
+    first = state.read_state()
+    assert state.read_state() is first
+    # same size, different mtime
+    st = os.stat(state_file)
+    with open(state_file, "w") as fp:
+        json.dump({"schema": state.STATE_SCHEMA, "commands": {}, "counter": 7}, fp)
+    os.utime(state_file, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert state.read_state()["counter"] == 7
+    # same size and mtime, different inode
+    st = os.stat(state_file)
+    tmp = state_file + ".new"
+    with open(tmp, "w") as fp:
+        json.dump({"schema": state.STATE_SCHEMA, "commands": {}, "counter": 8}, fp)
+    os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.replace(tmp, state_file)
+    assert state.read_state()["counter"] == 8
+
+
+def test_invalid_or_older_state_is_replaced(state_file):
+    with open(state_file, "w") as fp:
+        fp.write("{not json")
+    assert state.read_state()["commands"] == {}
+    with open(state_file, "w") as fp:
+        json.dump({"commands": {"/commands": {}}}, fp)
+    assert state.read_state()["commands"] == {}
+    state.update_state(_increment)
+    with open(state_file) as fp:
+        assert json.load(fp) == {"schema": state.STATE_SCHEMA, "commands": {}, "counter": 1}
+
+
+def test_newer_state_is_not_overwritten(state_file):
+    newer = {"schema": state.STATE_SCHEMA + 1, "something": ["new"]}
+    with open(state_file, "w") as fp:
+        json.dump(newer, fp)
+    assert state.read_state()["commands"] == {}
+    assert state.update_state(_increment)["counter"] == 1
+    with open(state_file) as fp:
+        assert json.load(fp) == newer
+
+
+def test_commands_link(tmp_path):
+    root = tmp_path.resolve() / "commands-multi"
+    tree = root / ".trees" / "daffy" / "a"
+    os.makedirs(tree)
+    os.symlink(os.path.join(".trees", "daffy", "a"), root / "daffy")
+    link = str(root / "daffy")
+    assert get_commands_link(str(tree)) == link
+    assert get_commands_link(str(tree) + os.sep) == link
+    assert get_commands_link(os.path.realpath(link)) == link
+    assert get_commands_link(link) == link
+    # the trees are found through a symlinked parent too
+    os.symlink(root, root.parent / "commands")
+    assert get_commands_link(str(root.parent / "commands" / ".trees" / "daffy" / "b")) == link
+    # commands that are not in a tree are used from where they are
+    other = str(root.parent / "my-commands")
+    assert get_commands_link(other) == other